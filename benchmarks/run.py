@@ -0,0 +1,527 @@
+# Python
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3 as sql
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+# Reproducible benchmark of every route, driven in-process through ASGI
+#   python -m benchmarks.run --scale 1000,100000 --concurrency 16 \
+#       --requests 2000 --output bench.json
+# Each scale runs in its own process against a freshly seeded database.
+
+
+class Scenario:
+    """ One route under load
+    - Args:
+      name: label in the report
+      method: HTTP method
+      path: request path, with {fields} filled by path_params
+      query: i -> query parameters of the i-th request
+      body: i -> JSON body of the i-th request
+      weight: fraction of --requests sent to this scenario
+      path_params: i -> fields of path for the i-th request
+      user: i -> id of the user sending the i-th request (user 1 by
+      default), called after query and body
+    """
+
+    def __init__(
+        self,
+        name: str,
+        method: str,
+        path: str,
+        query: Optional[Callable[[int], Dict]] = None,
+        body: Optional[Callable[[int], Any]] = None,
+        weight: float = 1.0,
+        path_params: Optional[Callable[[int], Dict]] = None,
+        user: Optional[Callable[[int], int]] = None
+    ) -> None:
+        self.name = name
+        self.method = method
+        self.path = path
+        self.query = query
+        self.body = body
+        self.weight = weight
+        self.path_params = path_params
+        self.user = user
+
+
+def scenarios(scale: int, rng: random.Random) -> List[Scenario]:
+    """ Every route of routes/, deletes last so the ids they remove are
+    not needed by the other scenarios
+    """
+    from benchmarks.seed import WORDS
+    from database.pagination import encode_cursor
+    import config
+
+    n_authors = max(1, scale // 10)
+    new_ids = itertools.count(1)
+
+    def book_id(i: int) -> int:
+        return rng.randint(1, scale)
+
+    def author_id(i: int) -> int:
+        return rng.randint(1, n_authors)
+
+    def page_after(i: int) -> str:
+        # Cursor of a random page, as a client paging through the books
+        id_book = rng.randint(0, max(0, scale - 100))
+        return encode_cursor('id_book', id_book, id_book)
+
+    def batch(random_id: Callable[[int], int]) -> str:
+        return ','.join(str(random_id(i)) for i in range(50))
+
+    def new_book(i: int) -> Dict:
+        return {'title': f"Bench {i}", 'pages': 100 + i % 900,
+                'language': 'english'}
+
+    def new_user(i: int) -> Dict:
+        return {'email': f"bench{next(new_ids)}@example.com",
+                'password': 'benchmark', 'firts_name': 'Bench'}
+
+    def login(id_user: int) -> Dict:
+        # Seeded passwords are plaintext: the first login rehashes them
+        return {'email': f"user{id_user}@example.com",
+                'password': f"password{id_user}"}
+
+    # Deletes walk down from the highest ids, one id per request
+    delete_books = itertools.count(scale, -1)
+    delete_authors = itertools.count(n_authors, -1)
+    delete_users = itertools.count(scale, -1)
+
+    # A user can only change itself: the user routes are sent as the
+    # user their query or body picked last
+    acting = [1]
+
+    def as_user(id_user: int) -> int:
+        acting[0] = id_user
+        return id_user
+
+    def acting_user(i: int) -> int:
+        return acting[0]
+
+    # Pairs the seed did not link, linked then unlinked in order
+    conn = sql.connect(os.environ['LIBRARY_DB'])
+    try:
+        book_authors = set(conn.execute(
+            "SELECT fk_id_book, fk_id_author FROM Book_Author"
+            ))
+        user_books = set(conn.execute(
+            "SELECT fk_id_user, fk_id_book FROM User_Book"
+            ))
+    finally:
+        conn.close()
+
+    def pairs(
+        names: Tuple[str, str],
+        left: int,
+        right: int,
+        seeded: set
+    ) -> Tuple[Callable[[int], Dict], Callable[[int], Dict]]:
+        free_pairs = (
+            (a, b)
+            for a in range(1, left + 1)
+            for b in range(1, right + 1)
+            if (a, b) not in seeded
+            )
+        linked: List[Tuple[int, int]] = []
+
+        def link(i: int) -> Dict:
+            linked.append(next(free_pairs))
+            return dict(zip(names, linked[-1]))
+
+        def unlink(i: int) -> Dict:
+            return dict(zip(names, linked.pop(0)))
+        return link, unlink
+
+    link, unlink = pairs(
+        ('id_book', 'id_author'), scale, n_authors, book_authors
+        )
+    link_book, unlink_book = pairs(
+        ('id_user', 'id_book'), scale, scale, user_books
+        )
+
+    def own(pair: Dict) -> Dict:
+        as_user(pair['id_user'])
+        return pair
+
+    return [
+        Scenario("home", "GET", "/"),
+        Scenario("stats", "GET", "/stats"),
+        Scenario("metrics", "GET", "/metrics", weight=0.1),
+        Scenario("books", "GET", "/books",
+                 query=lambda i: {'limit': 100}),
+        Scenario("books sorted by title", "GET", "/books",
+                 query=lambda i: {'limit': 100, 'sort': 'title'}),
+        Scenario("book details", "GET", "/book/details",
+                 query=lambda i: {'id_book': book_id(i)}),
+        Scenario("books batch", "GET", "/books/batch",
+                 query=lambda i: {'ids': batch(book_id)}),
+        Scenario("book new", "POST", "/book/new", body=new_book),
+        Scenario("book update", "PUT", "/book/update",
+                 body=lambda i: {'id_book': book_id(i), 'pages': 1 + i % 9}),
+        Scenario("books bulk new", "POST", "/books/bulk",
+                 body=lambda i: [new_book(i) for _ in range(100)],
+                 weight=0.1),
+        Scenario("books bulk update", "PUT", "/books/bulk",
+                 body=lambda i: [{'id_book': book_id(i), 'pages': 7}
+                                 for _ in range(100)],
+                 weight=0.1),
+        Scenario("books search", "GET", "/books/search",
+                 query=lambda i: {'q': rng.choice(WORDS)[:4]}),
+        Scenario("books with authors", "GET", "/books",
+                 query=lambda i: {'limit': 100, 'include': 'authors',
+                                  'cursor': page_after(i)}),
+        # Every client asks for the same page: identical concurrent reads
+        Scenario("books same page", "GET", "/books",
+                 query=lambda i: {'limit': 100, 'include': 'authors'}),
+        Scenario("book details with authors", "GET", "/book/details",
+                 query=lambda i: {'id_book': book_id(i),
+                                  'include': 'authors'}),
+        Scenario("book author link", "POST", "/book/author/link",
+                 body=link),
+        Scenario("book author unlink", "DELETE", "/book/author/unlink",
+                 query=unlink),
+        Scenario("books export", "GET", "/books/export", weight=0.01),
+        Scenario("authors", "GET", "/authors",
+                 query=lambda i: {'limit': 100}),
+        Scenario("author details", "GET", "/author/details",
+                 query=lambda i: {'id_author': author_id(i)}),
+        Scenario("authors batch", "GET", "/authors/batch",
+                 query=lambda i: {'ids': batch(author_id)}),
+        Scenario("author new", "POST", "/author/new",
+                 body=lambda i: {'name': f"Bench author {i}"}),
+        Scenario("author update", "PUT", "/author/update",
+                 body=lambda i: {'id_author': author_id(i),
+                                 'name': f"Renamed {i}"}),
+        Scenario("authors bulk new", "POST", "/authors/bulk",
+                 body=lambda i: [{'name': f"Bulk {i}"}] * 100,
+                 weight=0.1),
+        Scenario("authors bulk update", "PUT", "/authors/bulk",
+                 body=lambda i: [{'id_author': author_id(i),
+                                  'name': f"Bulk {i}", 'genre': 'Poetry'}
+                                 for _ in range(100)],
+                 weight=0.1),
+        Scenario("authors search", "GET", "/authors/search",
+                 query=lambda i: {'q': f"author {author_id(i)}"}),
+        Scenario("author books", "GET", "/author/{id_author}/books",
+                 path_params=lambda i: {'id_author': author_id(i)},
+                 query=lambda i: {'include': 'authors'}),
+        Scenario("authors export", "GET", "/authors/export", weight=0.01),
+        Scenario("users", "GET", "/users",
+                 query=lambda i: {'limit': 100}),
+        Scenario("user details", "GET", "/user/details",
+                 query=lambda i: {'id_user': book_id(i)}),
+        Scenario("users batch", "GET", "/users/batch",
+                 query=lambda i: {'ids': batch(book_id)}),
+        Scenario("user new", "POST", "/user/new", body=new_user),
+        Scenario("user update", "PUT", "/user/update",
+                 body=lambda i: {'id_user': as_user(book_id(i)),
+                                 'last_name': f"Last {i}"},
+                 user=acting_user),
+        Scenario("user update (deprecated)", "PUT",
+                 "/user/update_user/1/last_name/Bench"),
+        # As many users as passwords /users/bulk hashes in one request
+        Scenario("users bulk new", "POST", "/users/bulk",
+                 body=lambda i: [new_user(i)
+                                 for _ in range(config.PASSWORD_MAX_BULK)],
+                 weight=0.1),
+        # Half of the items name the caller, the rest are rejected
+        Scenario("users bulk update", "PUT", "/users/bulk",
+                 body=lambda i: [
+                     {'id_user': as_user(book_id(i)) if j % 2 else
+                      book_id(i), 'last_name': 'Bulk'}
+                     for j in range(100)
+                     ],
+                 weight=0.1, user=acting_user),
+        Scenario("login", "POST", "/login",
+                 body=lambda i: login(book_id(i)), weight=0.1),
+        Scenario("user books", "GET", "/user/{id_user}/books",
+                 path_params=lambda i: {'id_user': book_id(i)},
+                 query=lambda i: {'include': 'authors'}),
+        Scenario("user book link", "POST", "/user/book/link",
+                 body=lambda i: own(link_book(i)), user=acting_user),
+        Scenario("user book unlink", "DELETE", "/user/book/unlink",
+                 query=lambda i: own(unlink_book(i)), user=acting_user),
+        Scenario("users export", "GET", "/users/export", weight=0.01),
+        Scenario("book delete", "DELETE", "/book/delete",
+                 query=lambda i: {'id_book': next(delete_books)}),
+        Scenario("books bulk delete", "DELETE", "/books/bulk",
+                 body=lambda i: [next(delete_books) for _ in range(100)],
+                 weight=0.1),
+        Scenario("author delete", "DELETE", "/author/delete",
+                 query=lambda i: {'id_author': next(delete_authors)},
+                 weight=0.1),
+        Scenario("authors bulk delete", "DELETE", "/authors/bulk",
+                 body=lambda i: [next(delete_authors) for _ in range(10)],
+                 weight=0.01),
+        Scenario("user delete", "DELETE", "/user/delete",
+                 query=lambda i: {'id_user': as_user(next(delete_users))},
+                 user=acting_user),
+        # Only the caller is deleted, the other 99 ids are rejected
+        Scenario("users bulk delete", "DELETE", "/users/bulk",
+                 body=lambda i: [as_user(next(delete_users))] + [
+                     next(delete_users) for _ in range(99)
+                     ],
+                 weight=0.1, user=acting_user),
+    ]
+
+
+async def call(
+    app,
+    method: str,
+    path: str,
+    query: str = '',
+    body: Optional[bytes] = None,
+    headers: Sequence[Tuple[bytes, bytes]] = ()
+) -> int:
+    """ Send one request straight to the ASGI app, return its status """
+    payload = body or b''
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', b'benchmark'),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(payload)).encode()),
+            *headers,
+            ],
+        'client': ('127.0.0.1', 0),
+        'server': ('benchmark', 80),
+        }
+    received = False
+    status = 0
+
+    async def receive() -> Dict:
+        nonlocal received
+        if not received:
+            received = True
+            return {'type': 'http.request', 'body': payload,
+                    'more_body': False}
+        # Never disconnect; the app cancels this wait when it is done
+        await asyncio.Event().wait()
+
+    async def send(message: Dict) -> None:
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_scenario(
+    app,
+    scenario: Scenario,
+    requests: int,
+    concurrency: int,
+    headers: Callable[[int], Sequence[Tuple[bytes, bytes]]] = lambda id: ()
+) -> Dict:
+    """ Send `requests` requests of scenario from `concurrency` clients
+    - Args:
+      headers: id_user -> headers authenticating that user
+    """
+    counter = itertools.count()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def worker() -> None:
+        while True:
+            i = next(counter)
+            if i >= requests:
+                return
+            query = urlencode(scenario.query(i)) if scenario.query else ''
+            body = None
+            if scenario.body is not None:
+                body = json.dumps(scenario.body(i)).encode()
+            path = scenario.path
+            if scenario.path_params is not None:
+                path = path.format(**scenario.path_params(i))
+            user = scenario.user(i) if scenario.user else 1
+            start = time.perf_counter()
+            status = await call(app, scenario.method, path,
+                                query, body, headers(user))
+            latencies.append(time.perf_counter() - start)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            # A handler served from memory never suspends; a real server
+            # yields on every socket read, so let the other clients run
+            await asyncio.sleep(0)
+
+    # ru_maxrss is the peak of the whole process so far, so a scenario
+    # only reports how much it raised that peak
+    peak_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    peak_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'method': scenario.method,
+        'path': scenario.path,
+        'requests': requests,
+        'concurrency': concurrency,
+        'seconds': elapsed,
+        'throughput_rps': requests / elapsed if elapsed else 0.0,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50) * 1000,
+            'p95': percentile(latencies, 0.95) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000,
+            'max': max(latencies, default=0.0) * 1000,
+            },
+        'statuses': statuses,
+        'peak_rss_growth_kb': peak_after - peak_before,
+        }
+
+
+def run_scale(
+    scale: int,
+    requests: int,
+    concurrency: int,
+    seed_value: int,
+    only: Optional[List[str]]
+) -> Dict:
+    """ Seed a database of `scale` rows and load every route against it
+    (must run in a fresh process: the app reads LIBRARY_DB at import)
+    """
+    from benchmarks.seed import seed
+
+    seed_start = time.perf_counter()
+    seed(os.environ['LIBRARY_DB'], scale, seed_value)
+    seed_seconds = time.perf_counter() - seed_start
+
+    from main import app
+    from database.funtionsDB import engine
+
+    from security.tokens import token_signer
+
+    rng = random.Random(seed_value)
+    results = {}
+    # The write routes need a bearer token; /login has its own scenario
+    tokens: Dict[int, List[Tuple[bytes, bytes]]] = {}
+
+    def headers(id_user: int) -> List[Tuple[bytes, bytes]]:
+        if id_user not in tokens:
+            token, _ = token_signer.issue(
+                id_user, f"user{id_user}@example.com"
+                )
+            tokens[id_user] = [
+                (b'authorization', f"Bearer {token}".encode())
+                ]
+        return tokens[id_user]
+
+    async def main() -> None:
+        for scenario in scenarios(scale, rng):
+            if only and scenario.name not in only:
+                continue
+            n = max(1, int(requests * scenario.weight))
+            results[scenario.name] = await run_scenario(
+                app, scenario, n, concurrency, headers
+                )
+
+    asyncio.run(main())
+    engine.stop()
+    return {
+        'scale': scale,
+        'seed_seconds': seed_seconds,
+        'scenarios': results,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark every route at one or more dataset sizes"
+        )
+    parser.add_argument("--scale", default="1000",
+                        help="comma separated row counts, e.g. 1000,100000")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per scenario (scaled by its weight)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", default="",
+                        help="comma separated scenario names to run")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--single", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    scales = [int(s) for s in args.scale.split(',') if s]
+    only = [s for s in args.only.split(',') if s] or None
+
+    if args.single:
+        result = run_scale(scales[0], args.requests, args.concurrency,
+                           args.seed, only)
+        json.dump(result, sys.stdout)
+        return
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in scales:
+            env = dict(os.environ)
+            env['LIBRARY_DB'] = os.path.join(tmp, f"library_{scale}.db")
+            command = [
+                sys.executable, '-m', 'benchmarks.run', '--single',
+                '--scale', str(scale), '--requests', str(args.requests),
+                '--concurrency', str(args.concurrency),
+                '--seed', str(args.seed), '--only', args.only
+                ]
+            output = subprocess.run(command, env=env, capture_output=True,
+                                    text=True, check=True).stdout
+            runs.append(json.loads(output))
+            print(f"scale {scale}: done", file=sys.stderr)
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        'python': platform.python_version(),
+        'sqlite': sql.sqlite_version,
+        'platform': platform.platform(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'runs': runs,
+        }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    for run in runs:
+        print(f"\nscale {run['scale']}")
+        for name, r in run['scenarios'].items():
+            print(
+                f"  {name:24} {r['throughput_rps']:9.1f} req/s  "
+                f"p50 {r['latency_ms']['p50']:7.2f} ms  "
+                f"p99 {r['latency_ms']['p99']:7.2f} ms  {r['statuses']}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Python
+import argparse
+import os
+import random
+import sqlite3 as sql
+from datetime import date, timedelta
+from typing import Iterator, Tuple
+
+# Base data
+from database.migrations import migrate
+# Synthetic library data for the benchmarks
+#   python -m benchmarks.seed --scale 100000 --database /tmp/library.db
+
+READING_AGES = (
+    "No defined", "1 - 3 years", "4 - 7 years", "8 - 10 years",
+    "11 - 14 years", "15 - 17 years", "older than 18"
+)
+LANGUAGES = ("No defined", "english", "spanish", "french ", "german ")
+GENRES = ("Fantasy", "Mistery", "Horror", "Romance", "Poetry", "History")
+COUNTRIES = ("The UK", "Brazil", "Colombia", "Spain", "France", "Japan")
+WORDS = (
+    "monster", "calls", "river", "night", "garden", "silent", "city",
+    "winter", "shadow", "letters", "journey", "house", "stars", "sea"
+)
+
+
+def day(rng: random.Random) -> str:
+    days = timedelta(days=rng.randrange(27000))
+    return (date(1950, 1, 1) + days).isoformat()
+
+
+def users(n: int, rng: random.Random) -> Iterator[Tuple]:
+    for i in range(1, n + 1):
+        yield (
+            i, f"First{i}", f"Last{i}", f"user{i}@example.com",
+            f"password{i}", day(rng)
+            )
+
+
+def books(n: int, rng: random.Random) -> Iterator[Tuple]:
+    for i in range(1, n + 1):
+        added = day(rng)
+        yield (
+            i,
+            ' '.join(rng.choice(WORDS) for _ in range(3)).title(),
+            rng.choice(READING_AGES),
+            rng.randint(1, 10000),
+            rng.choice(LANGUAGES),
+            f"Publisher {rng.randrange(500)}",
+            added,
+            added
+            )
+
+
+def authors(n: int, rng: random.Random) -> Iterator[Tuple]:
+    for i in range(1, n + 1):
+        yield (
+            i, f"Author {i}", rng.choice(COUNTRIES), rng.choice(GENRES),
+            day(rng)
+            )
+
+
+def links(n: int, left: int, right: int, rng: random.Random) -> Iterator:
+    for i in range(1, n + 1):
+        yield (i, rng.randint(1, left), rng.randint(1, right))
+
+
+def seed(database: str, scale: int, seed_value: int = 42) -> None:
+    """ Create a fresh database with `scale` users and books,
+    scale / 10 authors and `scale` rows in each link table
+    """
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    rng = random.Random(seed_value)
+    n_authors = max(1, scale // 10)
+    conn = sql.connect(database)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    # Tables only; the indexes are built once the rows are in
+    migrate(conn, target=1)
+    conn.executemany(
+        "INSERT INTO User(id_user,firts_name,last_name,email,password,"
+        "birth_date) VALUES(?,?,?,?,?,?)", users(scale, rng))
+    conn.executemany(
+        "INSERT INTO Book(id_book,title,reading_age,pages,language,"
+        "publisher,date_add,date_update) VALUES(?,?,?,?,?,?,?,?)",
+        books(scale, rng))
+    conn.executemany(
+        "INSERT INTO Author(id_author,name,nationality,genre,birthdate) "
+        "VALUES(?,?,?,?,?)", authors(n_authors, rng))
+    conn.executemany(
+        "INSERT INTO User_Book(id_user_book,fk_id_user,fk_id_book) "
+        "VALUES(?,?,?)", links(scale, scale, scale, rng))
+    conn.executemany(
+        "INSERT INTO Book_Author(id_book_author,fk_id_author,fk_id_book) "
+        "VALUES(?,?,?)", links(scale, n_authors, scale, rng))
+    conn.commit()
+    migrate(conn)
+    conn.commit()
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Seed a database with synthetic library data"
+        )
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--scale", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    seed(args.database, args.scale, args.seed)
@@ -0,0 +1,103 @@
+# Python
+import os
+
+# Database
+DATABASE_PATH = os.getenv("LIBRARY_DB", "database/library.db")
+
+# Connection pool
+POOL_SIZE = int(os.getenv("LIBRARY_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT = float(os.getenv("LIBRARY_DB_POOL_TIMEOUT", "5"))
+POOL_HEALTH_CHECK_INTERVAL = float(
+    os.getenv("LIBRARY_DB_POOL_HEALTH_CHECK", "30")
+)
+# Connections of the table exports, apart from the pool of the reads so
+# a long export never holds one of those; the default is the sum of the
+# export limits in ADMISSION_ROUTE_LIMITS
+EXPORT_POOL_SIZE = int(os.getenv("LIBRARY_DB_EXPORT_POOL_SIZE", "6"))
+# Threads running the reads of the async handlers, 0 for one per pooled
+# connection
+READ_THREADS = int(os.getenv("LIBRARY_DB_READ_THREADS", "0"))
+# Identical concurrent reads share one query; milliseconds a request waits
+# for the shared result before querying on its own, 0 disables sharing
+COALESCE_WAIT_MS = float(os.getenv("LIBRARY_DB_COALESCE_WAIT_MS", "1000"))
+
+# SQLite pragmas applied once to every pooled connection
+SQLITE_JOURNAL_MODE = os.getenv("LIBRARY_DB_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("LIBRARY_DB_SYNCHRONOUS", "NORMAL")
+# Negative values are KiB, positive values are pages
+SQLITE_CACHE_SIZE = int(os.getenv("LIBRARY_DB_CACHE_SIZE", "-16000"))
+# Milliseconds SQLite itself waits on a locked database; then the job
+# is retried BUSY_RETRIES times, backing off from BUSY_BACKOFF_MS
+SQLITE_BUSY_TIMEOUT = int(os.getenv("LIBRARY_DB_BUSY_TIMEOUT", "250"))
+BUSY_RETRIES = int(os.getenv("LIBRARY_DB_BUSY_RETRIES", "3"))
+BUSY_BACKOFF_MS = float(os.getenv("LIBRARY_DB_BUSY_BACKOFF_MS", "20"))
+
+# Group commit: writes arriving within the window share one transaction,
+# 0 disables batching
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("LIBRARY_DB_GROUP_COMMIT_MS", "0"))
+GROUP_COMMIT_MAX_JOBS = int(os.getenv("LIBRARY_DB_GROUP_COMMIT_MAX", "64"))
+
+# Single entity caches (entries per table, seconds to live)
+CACHE_SIZE = int(os.getenv("LIBRARY_CACHE_SIZE", "1024"))
+CACHE_TTL = float(os.getenv("LIBRARY_CACHE_TTL", "60"))
+
+# Statements slower than this are logged with their EXPLAIN QUERY PLAN,
+# to LIBRARY_SLOW_QUERY_LOG when set or to stderr otherwise
+SLOW_QUERY_MS = float(os.getenv("LIBRARY_SLOW_QUERY_MS", "100"))
+SLOW_QUERY_LOG = os.getenv("LIBRARY_SLOW_QUERY_LOG", "")
+
+# Password hashing: 'scrypt' or 'pbkdf2_sha256' and its work factor;
+# hashes made with other parameters are replaced at the next login
+PASSWORD_SCHEME = os.getenv("LIBRARY_PASSWORD_SCHEME", "scrypt")
+PASSWORD_SCRYPT_N = int(os.getenv("LIBRARY_PASSWORD_SCRYPT_N", "16384"))
+PASSWORD_SCRYPT_R = int(os.getenv("LIBRARY_PASSWORD_SCRYPT_R", "8"))
+PASSWORD_PBKDF2_ITERATIONS = int(
+    os.getenv("LIBRARY_PASSWORD_PBKDF2_ITERATIONS", "600000")
+)
+# Hashing worker processes, and passwords allowed to wait for them
+# before new ones are answered with 503
+PASSWORD_WORKERS = int(os.getenv("LIBRARY_PASSWORD_WORKERS", "2"))
+PASSWORD_MAX_PENDING = int(
+    os.getenv("LIBRARY_PASSWORD_MAX_PENDING", "256")
+)
+# Passwords per worker job of the bulk routes, so logins run in between,
+# and most users with a password one bulk request may carry
+PASSWORD_CHUNK = int(os.getenv("LIBRARY_PASSWORD_CHUNK", "8"))
+PASSWORD_MAX_BULK = int(os.getenv("LIBRARY_PASSWORD_MAX_BULK", "64"))
+
+# Admission control: requests served at once and requests allowed to
+# queue per class (GET reads, other methods writes), and milliseconds a
+# request may queue before it is answered with 503; a limit of 0 turns
+# the limit off
+ADMISSION_READ_LIMIT = int(os.getenv("LIBRARY_ADMISSION_READ_LIMIT", "64"))
+ADMISSION_READ_QUEUE = int(os.getenv("LIBRARY_ADMISSION_READ_QUEUE", "256"))
+ADMISSION_READ_WAIT_MS = float(
+    os.getenv("LIBRARY_ADMISSION_READ_WAIT_MS", "500")
+)
+ADMISSION_WRITE_LIMIT = int(os.getenv("LIBRARY_ADMISSION_WRITE_LIMIT", "16"))
+ADMISSION_WRITE_QUEUE = int(
+    os.getenv("LIBRARY_ADMISSION_WRITE_QUEUE", "128")
+)
+ADMISSION_WRITE_WAIT_MS = float(
+    os.getenv("LIBRARY_ADMISSION_WRITE_WAIT_MS", "1000")
+)
+# Tighter limits of single routes, "METHOD /path=limit,..."; a limit of
+# 0 turns the limit of that route off, as for the classes
+ADMISSION_ROUTE_LIMITS = os.getenv(
+    "LIBRARY_ADMISSION_ROUTE_LIMITS",
+    "POST /login=8,GET /books/export=2,GET /authors/export=2,"
+    "GET /users/export=2"
+)
+
+# Login tokens: HMAC signed JWTs valid for JWT_TTL seconds. Without
+# LIBRARY_JWT_SECRET a random secret is made at startup, so tokens do not
+# survive a restart and are not shared between worker processes
+JWT_SECRET = os.getenv("LIBRARY_JWT_SECRET", "")
+JWT_ALGORITHM = os.getenv("LIBRARY_JWT_ALGORITHM", "HS256")
+JWT_TTL = int(os.getenv("LIBRARY_JWT_TTL", "3600"))
+# Verified tokens kept in memory, so a request does not decode its token
+TOKEN_CACHE_SIZE = int(os.getenv("LIBRARY_TOKEN_CACHE_SIZE", "4096"))
+
+# List endpoints encode their rows straight to JSON, skipping the
+# response_model validation pass (opt-in)
+FAST_JSON = os.getenv("LIBRARY_FAST_JSON", "0").lower() in ("1", "true", "yes")
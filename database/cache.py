@@ -0,0 +1,126 @@
+# Python
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable
+from typing import List, Optional
+
+
+class LRUCache:
+    """ Thread-safe LRU cache with a time to live per entry
+    - Args:
+      maxsize: maximum number of entries, the least recently used goes first
+      ttl: seconds an entry stays valid, 0 keeps it until evicted
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation so that a load racing with a write
+        # does not store the row it read before the write
+        self._generation = 0
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            value, expires = entry
+            if expires and expires < time.monotonic():
+                del self._data[key]
+                self._stats['expirations'] += 1
+                self._stats['misses'] += 1
+                return None
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        generation: Optional[int] = None,
+        ttl: Optional[float] = None
+    ) -> None:
+        """ Store value, unless an invalidation happened since generation
+        - Args:
+          ttl: seconds this entry stays valid, instead of the cache ttl
+        """
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl > 0 else 0
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    async def get_or_load_async(
+        self,
+        key: Hashable,
+        loader: Callable[[Hashable], Awaitable[Optional[Any]]]
+    ) -> Optional[Any]:
+        """ Read-through lookup, None results are not cached; a hit never
+        leaves the event loop
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        generation = self._generation
+        value = await loader(key)
+        if value is not None:
+            self.set(key, value, generation)
+        return value
+
+    async def get_many_or_load_async(
+        self,
+        keys: Iterable[Hashable],
+        loader: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]]
+    ) -> Dict[Hashable, Any]:
+        """ Read-through lookup of many keys; the missing ones are loaded
+        with a single loader call, keys it does not return are left out
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.get(key)
+            if value is None:
+                missing.append(key)
+            else:
+                found[key] = value
+        if missing:
+            generation = self._generation
+            for key, value in (await loader(missing)).items():
+                self.set(key, value, generation)
+                found[key] = value
+        return found
+
+    def invalidate(self, *keys: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    self._stats['invalidations'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'size': len(self._data), 'maxsize': self.maxsize})
+        return stats
@@ -0,0 +1,342 @@
+# Python
+import asyncio
+import queue
+import random
+import sqlite3 as sql
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from typing import List, Optional, Tuple
+
+# Pool
+from database.pool import ConnectionPool, is_busy
+from database.singleflight import SingleFlight
+from database.tracing import TracedConnection
+
+_STOP = object()
+
+
+class StorageEngine:
+    """ Single-writer / multi-reader access to the SQLite database
+
+    Every mutation is queued to one writer thread that owns the only
+    read-write connection, so writes never contend on the SQLite lock.
+    Reads check out read-only WAL connections from the pool and run in
+    parallel on the engine's reader threads, awaited through read_async.
+
+    With group commit enabled, jobs arriving within `group_window`
+    seconds (up to `group_max_jobs`) share one transaction and one
+    fsync; each job runs inside its own SAVEPOINT so a failing job only
+    rolls back its own changes.
+
+    read_shared lets identical concurrent reads share one query; version
+    counts the committed transactions so that no read shares a query
+    started before a write it must see.
+    - Args:
+      database: path of the SQLite file
+      readers: pool of read-only connections
+      pragmas: PRAGMA name -> value applied to the writer connection
+      busy_timeout: seconds SQLite waits on a locked database
+      group_window: seconds to wait for more jobs, 0 disables batching
+      group_max_jobs: maximum number of jobs per transaction
+      read_workers: reader threads of read_async, 0 for one per pooled
+      connection
+      coalesce_wait: seconds a read_shared caller waits for the query of
+      an identical call, 0 disables sharing
+      busy_retries: times a job failing with SQLITE_BUSY is run again,
+      after busy_timeout ran out
+      busy_backoff: seconds before the first retry, doubled after each
+    """
+
+    def __init__(
+        self,
+        database: str,
+        readers: ConnectionPool,
+        pragmas: Optional[Dict[str, object]] = None,
+        busy_timeout: float = 5.0,
+        group_window: float = 0.0,
+        group_max_jobs: int = 64,
+        read_workers: int = 0,
+        coalesce_wait: float = 1.0,
+        busy_retries: int = 3,
+        busy_backoff: float = 0.02
+    ) -> None:
+        self.database = database
+        self.readers = readers
+        self.pragmas = pragmas or {}
+        self.busy_timeout = busy_timeout
+        self.group_window = group_window
+        self.group_max_jobs = group_max_jobs
+        self.read_workers = read_workers or readers.size
+        self.busy_retries = busy_retries
+        self.busy_backoff = busy_backoff
+        self._stats = {'jobs': 0, 'transactions': 0, 'largest_group': 0,
+                       'busy_retries': 0}
+        # Bumped by the writer after every commit
+        self.version = 0
+        self.flights = SingleFlight(lambda: self.version, coalesce_wait)
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._reader_threads: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # Reads
+    async def read_async(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """ Run fn(conn, *args) on a reader thread with a pooled read-only
+        connection; the event loop only awaits the result
+        - Args:
+          fn: callable receiving the connection first, run in a copy of
+          the caller's context (request tracing included)
+        """
+        with self._lock:
+            if self._reader_threads is None:
+                self._reader_threads = ThreadPoolExecutor(
+                    max_workers=self.read_workers,
+                    thread_name_prefix="sqlite-reader"
+                    )
+            executor = self._reader_threads
+        run = partial(copy_context().run, self._read_job, fn, *args)
+        return await asyncio.get_running_loop().run_in_executor(executor, run)
+
+    async def read_shared(
+        self,
+        key: Hashable,
+        fn: Callable[..., Any],
+        *args: Any
+    ) -> Any:
+        """ read_async(fn, *args), sharing one query and its result with
+        the identical calls in progress; the result must not be mutated
+        - Args:
+          key: identifies fn and args, e.g. ('book', id_book); its first
+          item names the read in the metrics
+        """
+        return await self.flights.do(key, partial(self.read_async, fn, *args))
+
+    def shared_loader(
+        self,
+        name: str,
+        fn: Callable[..., Any]
+    ) -> Callable[[Hashable], Awaitable[Any]]:
+        """ key -> read_shared((name, key), fn, key), a loader for
+        LRUCache.get_or_load_async
+        """
+        def load(key: Hashable) -> Awaitable[Any]:
+            return self.read_shared((name, key), fn, key)
+        return load
+
+    def _read_job(self, fn: Callable[..., Any], *args: Any) -> Any:
+        attempt = 0
+        while True:
+            try:
+                with self.readers.connection() as conn:
+                    return fn(conn, *args)
+            except sql.OperationalError as e:
+                if not self._retry(e, attempt):
+                    raise
+                attempt += 1
+
+    # Writes
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """ Queue fn(conn, *args) on the writer thread
+        - Args:
+          fn: callable receiving the writer connection first, run in a
+          copy of the caller's context (request tracing included)
+        - Returns:
+          Future with fn's result; the transaction is committed when fn
+          returns and rolled back when it raises
+        """
+        future: Future = Future()
+        with self._lock:
+            self._ensure_started()
+            run = partial(copy_context().run, fn)
+            self._queue.put((run, args, future))
+        return future
+
+    def write(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """ Run fn on the writer thread and wait for its result """
+        return self.submit(fn, *args).result()
+
+    async def write_async(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """ Run fn on the writer thread, awaiting its result without
+        blocking the event loop
+        """
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run,
+                name="sqlite-writer",
+                daemon=True
+                )
+            self._thread.start()
+
+    def _connect(self) -> sql.Connection:
+        conn = sql.connect(
+            self.database,
+            timeout=self.busy_timeout,
+            factory=TracedConnection
+            )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def _run(self) -> None:
+        try:
+            conn = self._connect()
+        except BaseException as e:
+            # Fail whatever is queued; the next submit starts a new writer
+            with self._lock:
+                self._thread = None
+                while True:
+                    try:
+                        job = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if job is not _STOP:
+                        job[2].set_exception(e)
+            return
+        try:
+            while True:
+                job = self._queue.get()
+                if job is _STOP:
+                    break
+                if self.group_window <= 0:
+                    self._execute(conn, *job)
+                    continue
+                jobs, stop = self._collect(job)
+                self._execute_group(conn, jobs)
+                if stop:
+                    break
+        finally:
+            conn.close()
+
+    def _execute(self, conn, fn, args, future: Future) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        self._count(1)
+        attempt = 0
+        while True:
+            try:
+                result = fn(conn, *args)
+                conn.commit()
+            except BaseException as e:
+                conn.rollback()
+                if self._retry(e, attempt):
+                    attempt += 1
+                    continue
+                future.set_exception(e)
+            else:
+                self.version += 1
+                future.set_result(result)
+            return
+
+    def _collect(self, first: Tuple) -> Tuple[List[Tuple], bool]:
+        """ Gather the jobs arriving within the group commit window """
+        jobs = [first]
+        deadline = time.monotonic() + self.group_window
+        while len(jobs) < self.group_max_jobs:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    job = self._queue.get(timeout=remaining)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return jobs, True
+            jobs.append(job)
+        return jobs, False
+
+    def _execute_group(self, conn, jobs: List[Tuple]) -> None:
+        jobs = [j for j in jobs if j[2].set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        self._count(len(jobs))
+        attempt = 0
+        while True:
+            outcomes = []
+            try:
+                conn.execute("BEGIN")
+                for fn, args, future in jobs:
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        result = fn(conn, *args)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        if is_busy(e):
+                            # Not this job's fault: retry the whole group
+                            raise
+                        outcomes.append((future, False, e))
+                    else:
+                        outcomes.append((future, True, result))
+                    conn.execute("RELEASE job")
+                conn.commit()
+                self.version += 1
+                break
+            except BaseException as e:
+                # The whole group failed to commit, nobody's write is
+                # durable
+                if conn.in_transaction:
+                    conn.rollback()
+                if self._retry(e, attempt):
+                    attempt += 1
+                    continue
+                for _, _, future in jobs:
+                    future.set_exception(e)
+                return
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _retry(self, error: BaseException, attempt: int) -> bool:
+        """ Back off before trying a job again after SQLITE_BUSY
+        - Returns:
+          False when error is another error or the retries are spent
+        """
+        if not is_busy(error) or attempt >= self.busy_retries:
+            return False
+        with self._lock:
+            self._stats['busy_retries'] += 1
+        # Exponential, with jitter so that retries do not line up
+        time.sleep(self.busy_backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+        return True
+
+    def _count(self, jobs: int) -> None:
+        self._stats['jobs'] += jobs
+        self._stats['transactions'] += 1
+        if jobs > self._stats['largest_group']:
+            self._stats['largest_group'] = jobs
+
+    def stop(self) -> None:
+        """ Drain queued writes, stop the writer and reader threads and
+        close readers
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            reader_threads, self._reader_threads = self._reader_threads, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join()
+        if reader_threads is not None:
+            reader_threads.shutdown(wait=True)
+        self.readers.close()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'write_queue': self._queue.qsize(),
+            'group_commit_window': self.group_window,
+            **self._stats,
+            'version': self.version,
+            'coalescing': self.flights.stats(),
+            'writer_alive': self._thread is not None
+            and self._thread.is_alive(),
+            'read_workers': self.read_workers,
+            'readers': self.readers.stats(),
+        }
@@ -0,0 +1,64 @@
+# Python
+import csv
+import io
+import json
+from enum import Enum
+from typing import Iterator, Sequence
+
+# Pool
+from database.pool import ConnectionPool
+
+
+class ExportFormat(Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+MEDIA_TYPES = {
+    ExportFormat.ndjson: "application/x-ndjson",
+    ExportFormat.csv: "text/csv",
+}
+
+
+def export_rows(
+    pool: ConnectionPool,
+    table: str,
+    columns: Sequence[str],
+    key: str,
+    fmt: ExportFormat,
+    chunk_size: int = 1000
+) -> Iterator[bytes]:
+    """ Stream a whole table as NDJSON or CSV
+    - Args:
+      pool: pool the read connection is checked out from
+      table: table name
+      columns: exported columns
+      key: primary key, rows are sent in its order
+      fmt: output format
+      chunk_size: rows fetched and encoded per chunk
+    - Returns:
+      Iterator of encoded chunks, memory stays bounded by chunk_size
+    """
+    colums = ','.join(columns)
+    with pool.connection() as conn:
+        cur = conn.execute(f"SELECT {colums} FROM {table} ORDER BY {key}")
+        chunks = iter(lambda: cur.fetchmany(chunk_size), [])
+        if fmt is ExportFormat.csv:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for rows in chunks:
+                writer.writerows(rows)
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+            # Header only for an empty table
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        else:
+            for rows in chunks:
+                yield ''.join(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+                    + '\n'
+                    for row in rows
+                    ).encode()
@@ -1,107 +1,83 @@
-import sqlite3 as sql
-from sqlite3 import Error
+from typing import Iterator, List, Sequence
+
+# Config
+import config
+
+# Storage
+from database.pool import ConnectionPool
+from database.engine import StorageEngine
+from database.cache import LRUCache
+from database.migrations import migrate
+
+# Metrics
+from middlewares.metrics import registry
 # https://www.sqlitetutorial.net/ -- Tutorial SQLite3
 
+PRAGMAS = {
+    'journal_mode': config.SQLITE_JOURNAL_MODE,
+    'synchronous': config.SQLITE_SYNCHRONOUS,
+    'cache_size': config.SQLITE_CACHE_SIZE,
+    'foreign_keys': 'ON',
+    }
+
+# Read-only connections, used in parallel by the GET handlers
+pool = ConnectionPool(
+    config.DATABASE_PATH,
+    size=config.POOL_SIZE,
+    timeout=config.POOL_TIMEOUT,
+    health_check_interval=config.POOL_HEALTH_CHECK_INTERVAL,
+    busy_timeout=config.SQLITE_BUSY_TIMEOUT / 1000,
+    pragmas={**PRAGMAS, 'query_only': 'ON'}
+    )
+
+# Read-only connections of the exports, held for the whole stream
+export_pool = ConnectionPool(
+    config.DATABASE_PATH,
+    size=config.EXPORT_POOL_SIZE,
+    timeout=config.POOL_TIMEOUT,
+    health_check_interval=config.POOL_HEALTH_CHECK_INTERVAL,
+    busy_timeout=config.SQLITE_BUSY_TIMEOUT / 1000,
+    pragmas={**PRAGMAS, 'query_only': 'ON'}
+    )
+
+# Every mutation goes through the single writer thread of the engine
+engine = StorageEngine(
+    config.DATABASE_PATH,
+    readers=pool,
+    pragmas=PRAGMAS,
+    busy_timeout=config.SQLITE_BUSY_TIMEOUT / 1000,
+    group_window=config.GROUP_COMMIT_WINDOW_MS / 1000,
+    group_max_jobs=config.GROUP_COMMIT_MAX_JOBS,
+    read_workers=config.READ_THREADS,
+    coalesce_wait=config.COALESCE_WAIT_MS / 1000,
+    busy_retries=config.BUSY_RETRIES,
+    busy_backoff=config.BUSY_BACKOFF_MS / 1000
+    )
+registry.collect(engine.flights.metrics)
+
+# Read-through caches of single rows, invalidated by the write handlers
+book_cache = LRUCache(config.CACHE_SIZE, config.CACHE_TTL)
+author_cache = LRUCache(config.CACHE_SIZE, config.CACHE_TTL)
+user_cache = LRUCache(config.CACHE_SIZE, config.CACHE_TTL)
+
 
-def connectionDB() -> sql.Connection:
-    conn = sql.connect("database/library.db")
-    return conn
+def chunks(values: Sequence, size: int = 500) -> Iterator[List]:
+    """ Split values in lists short enough for an IN (...) clause """
+    for i in range(0, len(values), size):
+        yield list(values[i:i + size])
 
 
-def create_table(conn, create_table_sql):
-    """ create a table from the create_table_sql statement
-    - Args:
-      conn: Connection object
-      create_table_sql: a CREATE TABLE statement
-    - Returns:
-      Optional [print error]
-    """
-    try:
-        c = conn.cursor()
-        c.execute(create_table_sql)
-    except Error as e:
-        print(e)
+def placeholders(values: Sequence) -> str:
+    return ','.join('?' * len(values))
 
 
 def main():
-    conn = connectionDB()
-    sql_create_table_user = """CREATE TABLE IF NOT EXISTS User (
-        id_user integer NOT NULL,
-        firts_name text,
-        last_name text,
-        email text NOT NULL,
-        password text NOT NULL,
-        birth_date text,
-        PRIMARY KEY(id_user),
-        UNIQUE(id_user,email)
-        );"""
-    sql_create_table_Book = """CREATE TABLE IF NOT EXISTS Book (
-        id_book integer NOT NULL,
-        title text,
-        reading_age text,
-        pages integer,
-        language text,
-        publisher text,
-        date_add text NOT NULL,
-        date_update text,
-        PRIMARY KEY(id_book),
-        UNIQUE(id_book)
-        );"""
-    sql_create_table_Author = """CREATE TABLE IF NOT EXISTS Author (
-        id_author integer NOT NULL,
-        name text NOT NULL,
-        nationality text,
-        genre text,
-        birthdate text,
-        PRIMARY KEY(id_author),
-        UNIQUE(id_author)
-        );"""
-    sql_create_table_User_Book = """CREATE TABLE IF NOT EXISTS User_Book (
-        id_user_book integer NOT NULL,
-        fk_id_user integer NOT NULL,
-        fk_id_book integer NOT NULL,
-        PRIMARY KEY(id_user_book),
-        UNIQUE(id_user_book),
-        FOREIGN KEY (fk_id_user)
-            REFERENCES User (id_user)
-                ON UPDATE CASCADE
-                ON DELETE CASCADE,
-        FOREIGN KEY (fk_id_book)
-            REFERENCES Book (id_book)
-                ON UPDATE CASCADE
-                ON DELETE CASCADE
-        );"""
-    sql_create_table_Book_Author = """CREATE TABLE IF NOT EXISTS Book_Author (
-        id_book_author integer NOT NULL,
-        fk_id_author integer NOT NULL,
-        fk_id_book integer NOT NULL,
-        PRIMARY KEY(id_book_author),
-        UNIQUE(id_book_author),
-        FOREIGN KEY (fk_id_author)
-            REFERENCES Author (id_author)
-                ON UPDATE CASCADE
-                ON DELETE CASCADE,
-        FOREIGN KEY (fk_id_book)
-            REFERENCES Book (id_book)
-                ON UPDATE CASCADE
-                ON DELETE CASCADE
-        );"""
-    if conn is not None:
-        # create projects table
-        create_table(conn, sql_create_table_user)
-        create_table(conn, sql_create_table_Book)
-        create_table(conn, sql_create_table_Author)
-        create_table(conn, sql_create_table_User_Book)
-        create_table(conn, sql_create_table_Book_Author)
-    conn.commit()
-    conn.close()
+    """ Bring the schema up to date through the writer """
+    engine.write(migrate)
 
 
 if __name__ == "__main__":
-    # main()
-    conn = connectionDB()
-    conn.commit()
-    conn.close()
+    main()
     print('fin')
     features = "id_book,title,reading_age,pages,\
 language,publisher,date_add,date_update"
@@ -0,0 +1,263 @@
+# Python
+import argparse
+import sqlite3 as sql
+from typing import Callable, List, NamedTuple, Optional, Sequence, Union
+
+# Config
+import config
+
+# Versioned schema of library.db
+#   python -m database.migrations [--database PATH] [--target N] [--status]
+# The applied version is kept in PRAGMA user_version. Migrations only go
+# forward: to drop or change an index, append a new migration.
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    steps: Union[Sequence[str], Callable[[sql.Connection], None]]
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "tables", (
+        """CREATE TABLE IF NOT EXISTS User (
+            id_user integer NOT NULL,
+            firts_name text,
+            last_name text,
+            email text NOT NULL,
+            password text NOT NULL,
+            birth_date text,
+            PRIMARY KEY(id_user),
+            UNIQUE(id_user,email)
+            )""",
+        """CREATE TABLE IF NOT EXISTS Book (
+            id_book integer NOT NULL,
+            title text,
+            reading_age text,
+            pages integer,
+            language text,
+            publisher text,
+            date_add text NOT NULL,
+            date_update text,
+            PRIMARY KEY(id_book),
+            UNIQUE(id_book)
+            )""",
+        """CREATE TABLE IF NOT EXISTS Author (
+            id_author integer NOT NULL,
+            name text NOT NULL,
+            nationality text,
+            genre text,
+            birthdate text,
+            PRIMARY KEY(id_author),
+            UNIQUE(id_author)
+            )""",
+        """CREATE TABLE IF NOT EXISTS User_Book (
+            id_user_book integer NOT NULL,
+            fk_id_user integer NOT NULL,
+            fk_id_book integer NOT NULL,
+            PRIMARY KEY(id_user_book),
+            UNIQUE(id_user_book),
+            FOREIGN KEY (fk_id_user)
+                REFERENCES User (id_user)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE,
+            FOREIGN KEY (fk_id_book)
+                REFERENCES Book (id_book)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE
+            )""",
+        """CREATE TABLE IF NOT EXISTS Book_Author (
+            id_book_author integer NOT NULL,
+            fk_id_author integer NOT NULL,
+            fk_id_book integer NOT NULL,
+            PRIMARY KEY(id_book_author),
+            UNIQUE(id_book_author),
+            FOREIGN KEY (fk_id_author)
+                REFERENCES Author (id_author)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE,
+            FOREIGN KEY (fk_id_book)
+                REFERENCES Book (id_book)
+                    ON UPDATE CASCADE
+                    ON DELETE CASCADE
+            )""",
+        )),
+    # Keyset pagination sort keys and email uniqueness
+    Migration(2, "sort and email indexes", (
+        "CREATE INDEX IF NOT EXISTS idx_book_title ON Book(title)",
+        "CREATE INDEX IF NOT EXISTS idx_author_name ON Author(name)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_email_unique "
+        "ON User(email)",
+        "DROP INDEX IF EXISTS idx_user_email",
+        )),
+    # Both directions of each link table; holding both foreign keys, the
+    # indexes cover the joins and the ON DELETE CASCADE lookups
+    Migration(3, "link table indexes", (
+        "CREATE INDEX IF NOT EXISTS idx_user_book_user "
+        "ON User_Book(fk_id_user, fk_id_book)",
+        "CREATE INDEX IF NOT EXISTS idx_user_book_book "
+        "ON User_Book(fk_id_book, fk_id_user)",
+        "CREATE INDEX IF NOT EXISTS idx_book_author_author "
+        "ON Book_Author(fk_id_author, fk_id_book)",
+        "CREATE INDEX IF NOT EXISTS idx_book_author_book "
+        "ON Book_Author(fk_id_book, fk_id_author)",
+        )),
+    Migration(4, "planner statistics", ("ANALYZE",)),
+    # External content FTS5 indexes, kept in sync by triggers; prefix
+    # indexes of 2 and 3 characters serve short "word*" queries
+    Migration(5, "full-text search", (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS Book_fts USING fts5("
+        "title, publisher, content='Book', content_rowid='id_book', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        """CREATE TRIGGER IF NOT EXISTS Book_fts_insert AFTER INSERT ON Book
+        BEGIN
+            INSERT INTO Book_fts(rowid, title, publisher)
+            VALUES (new.id_book, new.title, new.publisher);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS Book_fts_delete AFTER DELETE ON Book
+        BEGIN
+            INSERT INTO Book_fts(Book_fts, rowid, title, publisher)
+            VALUES ('delete', old.id_book, old.title, old.publisher);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS Book_fts_update
+        AFTER UPDATE OF title, publisher ON Book
+        BEGIN
+            INSERT INTO Book_fts(Book_fts, rowid, title, publisher)
+            VALUES ('delete', old.id_book, old.title, old.publisher);
+            INSERT INTO Book_fts(rowid, title, publisher)
+            VALUES (new.id_book, new.title, new.publisher);
+        END""",
+        "INSERT INTO Book_fts(Book_fts) VALUES ('rebuild')",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS Author_fts USING fts5("
+        "name, genre, content='Author', content_rowid='id_author', "
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        """CREATE TRIGGER IF NOT EXISTS Author_fts_insert
+        AFTER INSERT ON Author
+        BEGIN
+            INSERT INTO Author_fts(rowid, name, genre)
+            VALUES (new.id_author, new.name, new.genre);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS Author_fts_delete
+        AFTER DELETE ON Author
+        BEGIN
+            INSERT INTO Author_fts(Author_fts, rowid, name, genre)
+            VALUES ('delete', old.id_author, old.name, old.genre);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS Author_fts_update
+        AFTER UPDATE OF name, genre ON Author
+        BEGIN
+            INSERT INTO Author_fts(Author_fts, rowid, name, genre)
+            VALUES ('delete', old.id_author, old.name, old.genre);
+            INSERT INTO Author_fts(rowid, name, genre)
+            VALUES (new.id_author, new.name, new.genre);
+        END""",
+        "INSERT INTO Author_fts(Author_fts) VALUES ('rebuild')",
+        )),
+    # A pair is linked at most once, so linking is one INSERT ... ON
+    # CONFLICT; the unique indexes replace the non-unique ones of
+    # migration 3 with the same columns
+    Migration(6, "unique links", (
+        """DELETE FROM Book_Author WHERE id_book_author NOT IN (
+            SELECT min(id_book_author) FROM Book_Author
+            GROUP BY fk_id_book, fk_id_author
+            )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_book_author_pair "
+        "ON Book_Author(fk_id_book, fk_id_author)",
+        "DROP INDEX IF EXISTS idx_book_author_book",
+        """DELETE FROM User_Book WHERE id_user_book NOT IN (
+            SELECT min(id_user_book) FROM User_Book
+            GROUP BY fk_id_user, fk_id_book
+            )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_book_pair "
+        "ON User_Book(fk_id_user, fk_id_book)",
+        "DROP INDEX IF EXISTS idx_user_book_user",
+        )),
+    # Book.title may be NULL and sort=title pages by COALESCE(title, ''),
+    # which only this expression index serves
+    Migration(7, "nullable title sort key", (
+        "CREATE INDEX IF NOT EXISTS idx_book_title_sort "
+        "ON Book(COALESCE(title, ''))",
+        "DROP INDEX IF EXISTS idx_book_title",
+        "ANALYZE Book",
+        )),
+]
+
+
+def current_version(conn: sql.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(
+    conn: sql.Connection,
+    target: Optional[int] = None,
+    migrations: Sequence[Migration] = MIGRATIONS
+) -> List[int]:
+    """ Apply the pending migrations up to target (default: the last)
+    - Args:
+      conn: read-write connection
+      target: version to stop at
+      migrations: migrations ordered by version
+    - Returns:
+      Versions applied, empty when the schema was up to date
+
+    Each migration and its user_version bump run in one SAVEPOINT, so a
+    failing migration leaves the schema at the previous version. A
+    savepoint also nests inside the writer's group commit transaction.
+    """
+    applied = []
+    version = current_version(conn)
+    for migration in migrations:
+        if migration.version <= version:
+            continue
+        if target is not None and migration.version > target:
+            break
+        conn.execute("SAVEPOINT migration")
+        try:
+            if callable(migration.steps):
+                migration.steps(conn)
+            else:
+                for statement in migration.steps:
+                    conn.execute(statement)
+            # PRAGMA does not take parameters; version is an int
+            conn.execute(f"PRAGMA user_version = {int(migration.version)}")
+        except BaseException:
+            # Some errors already rolled the whole transaction back
+            if conn.in_transaction:
+                conn.execute("ROLLBACK TO migration")
+                conn.execute("RELEASE migration")
+            raise
+        conn.execute("RELEASE migration")
+        version = migration.version
+        applied.append(version)
+    return applied
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Bring the library database schema up to date"
+        )
+    parser.add_argument("--database", default=config.DATABASE_PATH)
+    parser.add_argument("--target", type=int, default=None,
+                        help="stop at this version")
+    parser.add_argument("--status", action="store_true",
+                        help="only show the applied and pending versions")
+    args = parser.parse_args(argv)
+    conn = sql.connect(args.database, isolation_level=None)
+    try:
+        version = current_version(conn)
+        if args.status:
+            for m in MIGRATIONS:
+                state = "applied" if m.version <= version else "pending"
+                print(f"{m.version:4} {state:8} {m.description}")
+            return
+        applied = migrate(conn, args.target)
+        for m in MIGRATIONS:
+            if m.version in applied:
+                print(f"applied {m.version}: {m.description}")
+        print(f"schema version {current_version(conn)}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Python
+import base64
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+# Keyset pagination: pages are read with an index seek on (sort, key)
+# after the last row of the previous page, never with OFFSET
+
+# Range of a SQLite INTEGER; larger Python ints cannot be bound
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def encode_cursor(sort: str, value: Any, key: int) -> str:
+    """ Opaque cursor pointing right after the row (value, key) """
+    raw = json.dumps([sort, value, key], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def is_int64(value: Any) -> bool:
+    """ value is an int (not a bool) that fits a SQLite INTEGER """
+    return (
+        isinstance(value, int) and not isinstance(value, bool)
+        and INT64_MIN <= value <= INT64_MAX
+        )
+
+
+def decode_cursor(cursor: str, sort: str) -> Tuple[Any, int]:
+    """ Inverse of encode_cursor
+    - Raises:
+      ValueError if the cursor is malformed or was made for another sort
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, key = json.loads(
+            base64.urlsafe_b64decode(padded.encode())
+            )
+    except Exception:
+        raise ValueError("¡The cursor is not valid!")
+    if cursor_sort != sort:
+        raise ValueError("¡The cursor does not match the sort!")
+    # Only what encode_cursor writes: a column value and a rowid, else
+    # binding them would fail with a 500
+    if not is_int64(key) or not (
+            value is None or isinstance(value, (str, float))
+            or is_int64(value)):
+        raise ValueError("¡The cursor is not valid!")
+    return value, key
+
+
+def keyset_query(
+    table: str,
+    columns: Sequence[str],
+    key: str,
+    sort: str,
+    cursor: Optional[str],
+    limit: int,
+    nullable: bool = False
+) -> Tuple[str, List[Any]]:
+    """ SELECT of one page ordered by (sort, key)
+    - Args:
+      table: table name
+      columns: selected columns, must contain key and sort
+      key: primary key column
+      sort: column to order by (the primary key or an indexed column)
+      cursor: next_cursor of the previous page or None for the first one
+      limit: page size, one extra row is read to detect the next page
+      nullable: sort may be NULL; it is ordered as COALESCE(sort, ''),
+      which needs an index on that expression
+    - Returns:
+      sql and its parameters
+    """
+    colums = ','.join(columns)
+    # NULL compares to nothing, a NULL row would end the pages
+    column = f"COALESCE({sort}, '')" if nullable else sort
+    order = key if sort == key else f"{column},{key}"
+    where = ''
+    params: List[Any] = []
+    if cursor is not None:
+        value, last = decode_cursor(cursor, sort)
+        if sort == key:
+            where = f"WHERE {key} > ?"
+            params.append(last)
+        else:
+            # (column, key) > (value, last), in a form that also seeks
+            # on an expression index
+            where = f"WHERE {column} >= ? AND ({column} > ? OR {key} > ?)"
+            value = '' if value is None else value
+            params.extend([value, value, last])
+    params.append(limit + 1)
+    sql = f"SELECT {colums} FROM {table} {where} ORDER BY {order} LIMIT ?"
+    return sql, params
+
+
+def next_page(
+    rows: List[tuple],
+    columns: Sequence[str],
+    key: str,
+    sort: str,
+    limit: int
+) -> Tuple[List[tuple], Optional[str]]:
+    """ Trim the extra row read by keyset_query and build next_cursor """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    value = last[columns.index(sort)]
+    next_cursor = encode_cursor(
+        sort, '' if value is None else value, last[columns.index(key)]
+        )
+    return rows, next_cursor
+
+
+def page_headers(url: Any, next_cursor: Optional[str]) -> dict:
+    """ X-Next-Cursor and Link headers for the page served at url """
+    if next_cursor is None:
+        return {}
+    next_url = url.include_query_params(cursor=next_cursor)
+    return {
+        'X-Next-Cursor': next_cursor,
+        'Link': f'<{next_url}>; rel="next"',
+        }
+
+
+def offset_headers(url: Any, offset: int, limit: int, more: bool) -> dict:
+    """ X-Next-Offset and Link headers of an offset page (search
+    results are ordered by rank, which has no stable keyset)
+    """
+    if not more:
+        return {}
+    next_offset = offset + limit
+    next_url = url.include_query_params(offset=next_offset)
+    return {
+        'X-Next-Offset': str(next_offset),
+        'Link': f'<{next_url}>; rel="next"',
+        }
@@ -0,0 +1,196 @@
+# Python
+import queue
+import sqlite3 as sql
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+# Tracing
+from database.tracing import TracedConnection
+
+
+class PoolTimeout(sql.OperationalError):
+    """ Raised when no connection could be checked out in time """
+
+
+def is_busy(error: BaseException) -> bool:
+    """ True for SQLITE_BUSY / SQLITE_LOCKED: another connection holds
+    the lock and the statement may succeed if tried again
+    """
+    if not isinstance(error, sql.OperationalError):
+        return False
+    code = getattr(error, 'sqlite_errorcode', None)
+    if code is not None:
+        # Extended codes (SQLITE_BUSY_SNAPSHOT...) keep the primary code
+        # in their low byte
+        return (code & 0xff) in (sql.SQLITE_BUSY, sql.SQLITE_LOCKED)
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+class PooledConnection(TracedConnection):
+    """ sqlite3 connection that goes back to its pool on close()
+
+    Handlers keep calling conn.close() as they always did; the
+    connection is only really closed by the pool itself.
+    """
+    pool: Optional["ConnectionPool"] = None
+    last_used: float = 0.0
+    checked_out: bool = False
+
+    def close(self) -> None:
+        if self.pool is None:
+            super().close()
+        elif self.checked_out:
+            self.pool.release(self)
+
+    def _close(self) -> None:
+        super().close()
+
+
+class ConnectionPool:
+    """ Bounded pool of pre-configured SQLite connections
+    - Args:
+      database: path of the SQLite file
+      size: maximum number of open connections
+      timeout: seconds to wait for a free connection
+      pragmas: PRAGMA name -> value run once per new connection
+      health_check_interval: idle seconds before a connection is pinged
+      busy_timeout: seconds SQLite waits on a locked database
+    """
+
+    def __init__(
+        self,
+        database: str,
+        size: int = 8,
+        timeout: float = 5.0,
+        pragmas: Optional[Dict[str, object]] = None,
+        health_check_interval: float = 30.0,
+        busy_timeout: float = 5.0
+    ) -> None:
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self.health_check_interval = health_check_interval
+        self.busy_timeout = busy_timeout
+        self._idle: "queue.LifoQueue[PooledConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'created': 0,
+            'closed': 0,
+            'checkouts': 0,
+            'checkins': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'in_use': 0,
+            'wait_time_total': 0.0,
+        }
+
+    def _connect(self) -> PooledConnection:
+        conn = sql.connect(
+            self.database,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            factory=PooledConnection
+        )
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        conn.pool = self
+        with self._lock:
+            self._stats['created'] += 1
+        return conn
+
+    def _discard(self, conn: PooledConnection) -> None:
+        conn.pool = None
+        try:
+            conn._close()
+        except sql.Error:
+            pass
+        with self._lock:
+            self._stats['closed'] += 1
+
+    def _healthy(self, conn: PooledConnection) -> bool:
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            # A plain cursor, so the ping is not counted as a query
+            sql.Cursor(conn).execute("SELECT 1").fetchone()
+            return True
+        except sql.Error:
+            with self._lock:
+                self._stats['health_check_failures'] += 1
+            return False
+
+    def acquire(self) -> PooledConnection:
+        """ Check out a connection, waiting up to `timeout` seconds """
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats['timeouts'] += 1
+            raise PoolTimeout(
+                f"No database connection available after {self.timeout}s"
+                )
+        try:
+            conn = None
+            while conn is None:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if not self._healthy(conn):
+                    self._discard(conn)
+                    conn = None
+        except BaseException:
+            self._slots.release()
+            raise
+        conn.checked_out = True
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['wait_time_total'] += time.monotonic() - start
+        return conn
+
+    def release(self, conn: PooledConnection) -> None:
+        """ Check a connection back in, rolling back any open transaction """
+        conn.checked_out = False
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sql.Error:
+            healthy = False
+        conn.last_used = time.monotonic()
+        with self._lock:
+            self._stats['checkins'] += 1
+            self._stats['in_use'] -= 1
+        if healthy:
+            self._idle.put(conn)
+        else:
+            self._discard(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({'size': self.size, 'idle': self._idle.qsize()})
+        return stats
+
+    def close(self) -> None:
+        """ Close every idle connection (the pool stays usable) """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -1,3 +1,6 @@
+-- Historical MySQL Workbench model, kept for reference only: the SQLite
+-- schema of library.db is owned by database/migrations.py
+
 -- MySQL Script generated by MySQL Workbench
 -- vie 27 ene 2023 13:32:14
 -- Model: New Model    Version: 1.0
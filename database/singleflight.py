@@ -0,0 +1,137 @@
+# Python
+import asyncio
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, Hashable, List
+
+# Metrics
+from middlewares.metrics import labels
+
+
+class Flight:
+    """ One load in progress and the write version it started at """
+
+    __slots__ = ('task', 'version')
+
+    def __init__(self, task: "asyncio.Future", version: int) -> None:
+        self.task = task
+        self.version = version
+
+
+class SingleFlight:
+    """ Concurrent identical reads share one load and its result
+
+    The first caller of a key starts the load, callers arriving while it
+    runs wait for the same result instead of running their own query. A
+    flight is only joined while no write has committed since it started
+    (version() unchanged), so a client always reads its own writes.
+    Followers wait at most max_wait seconds, then load on their own;
+    0 turns coalescing off.
+    Only used from the event loop, so no locking is needed.
+    - Args:
+      version: current write version, see StorageEngine.version
+      max_wait: seconds a follower waits for the shared result
+      hot_keys: keys kept with their follower counts for stats()
+    """
+
+    def __init__(
+        self,
+        version: Callable[[], int],
+        max_wait: float = 1.0,
+        hot_keys: int = 1024
+    ) -> None:
+        self.version = version
+        self.max_wait = max_wait
+        self.hot_keys = hot_keys
+        self._flights: Dict[Hashable, Flight] = {}
+        # Counters per key name (the first item of a tuple key)
+        self._counts: Dict[str, Dict[str, int]] = defaultdict(
+            lambda: {'leaders': 0, 'followers': 0, 'timeouts': 0}
+            )
+        # Followers per key, least recently coalesced first
+        self._hot: "OrderedDict[Hashable, int]" = OrderedDict()
+
+    @staticmethod
+    def name(key: Hashable) -> str:
+        return str(key[0] if isinstance(key, tuple) else key)
+
+    async def do(
+        self,
+        key: Hashable,
+        load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """ Result of load(), shared with the identical calls in progress
+        - Args:
+          key: identifies the query and all of its parameters
+          load: starts the query, called at most once per flight
+        - Raises:
+          Whatever load raises, to every caller sharing the flight
+        """
+        if self.max_wait <= 0:
+            return await load()
+        counts = self._counts[self.name(key)]
+        version = self.version()
+        flight = self._flights.get(key)
+        if flight is not None and flight.version == version:
+            counts['followers'] += 1
+            self._hot[key] = self._hot.pop(key, 0) + 1
+            if len(self._hot) > self.hot_keys:
+                self._hot.popitem(last=False)
+            try:
+                # shield: a follower timing out does not cancel the load
+                return await asyncio.wait_for(
+                    asyncio.shield(flight.task), self.max_wait
+                    )
+            except asyncio.TimeoutError:
+                counts['timeouts'] += 1
+                return await load()
+        counts['leaders'] += 1
+        task = asyncio.ensure_future(load())
+        flight = Flight(task, version)
+        self._flights[key] = flight
+        task.add_done_callback(lambda task: self._land(key, flight))
+        # The load goes on for the followers if the leader is cancelled
+        return await asyncio.shield(task)
+
+    def _land(self, key: Hashable, flight: Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled():
+            # Retrieved here so an error nobody waited for is not logged
+            flight.task.exception()
+
+    def stats(self, top: int = 10) -> Dict[str, object]:
+        hottest = sorted(self._hot.items(), key=lambda item: -item[1])[:top]
+        return {
+            'max_wait': self.max_wait,
+            'in_flight': len(self._flights),
+            'keys': {name: dict(n) for name, n in self._counts.items()},
+            'hot_keys': [
+                {'key': repr(key), 'followers': n} for key, n in hottest
+                ],
+            }
+
+    def metrics(self) -> List[str]:
+        """ Prometheus lines for middlewares.metrics.registry """
+        in_flight: Dict[str, int] = defaultdict(int)
+        for key in self._flights:
+            in_flight[self.name(key)] += 1
+        lines = [
+            "# HELP db_read_flights In-flight shared reads by key name.",
+            "# TYPE db_read_flights gauge",
+            ]
+        for name in self._counts:
+            lines.append(
+                f"db_read_flights{labels(key=name)} {in_flight[name]}"
+                )
+        lines.extend([
+            "# HELP db_read_coalesced_total Reads by key name: leaders ran"
+            " the query, followers shared it, timeouts stopped waiting.",
+            "# TYPE db_read_coalesced_total counter",
+            ])
+        for name, counts in self._counts.items():
+            for role, n in counts.items():
+                lines.append(
+                    f"db_read_coalesced_total{labels(key=name, role=role)}"
+                    f" {n}"
+                    )
+        return lines
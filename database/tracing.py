@@ -0,0 +1,191 @@
+# Python
+import logging
+import sqlite3 as sql
+import time
+from contextvars import ContextVar
+from typing import Any, Iterable, Optional
+
+# Config
+import config
+
+slow_query_log = logging.getLogger("library.slow_query")
+if config.SLOW_QUERY_LOG:
+    _handler = logging.FileHandler(config.SLOW_QUERY_LOG)
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_log.addHandler(_handler)
+
+
+class QueryStats:
+    """ SQLite work done on behalf of one request """
+    __slots__ = ('queries', 'rows', 'seconds')
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.2f};'
+            f'desc="{self.queries} queries, {self.rows} rows"'
+            )
+
+
+# Connection setup and transaction control, not counted as queries
+NOT_QUERIES = frozenset((
+    'PRAGMA', 'BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE'
+    ))
+
+
+def is_query(statement: str) -> bool:
+    words = statement.split(None, 1)
+    return bool(words) and words[0].upper() not in NOT_QUERIES
+
+
+# Set per request by middlewares.query_tracing; the threadpool and the
+# writer thread run their work in a copy of the request context
+current_trace: ContextVar[Optional[QueryStats]] = ContextVar(
+    'current_trace', default=None
+    )
+
+
+def log_slow_query(
+    conn: sql.Connection,
+    statement: str,
+    parameters: Any,
+    seconds: float
+) -> None:
+    """ Write a slow statement with its EXPLAIN QUERY PLAN """
+    try:
+        # A plain cursor, so the plan lookup is not traced itself
+        plan = sql.Cursor(conn).execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+            ).fetchall()
+        plan = '; '.join(row[-1] for row in plan)
+    except sql.Error as e:
+        plan = f"unavailable ({e})"
+    slow_query_log.warning(
+        "%.1f ms: %s params=%r plan=[%s]",
+        seconds * 1000, ' '.join(statement.split()), parameters, plan
+        )
+
+
+class TracingCursor(sql.Cursor):
+    """ Cursor counting and timing its statements and counting the rows
+    they return
+
+    Only the statements run through it are counted, not the trigger
+    statements they fire, and PRAGMAs and transaction control are left
+    out (see NOT_QUERIES), so a request counts the same queries on a new
+    or a reused connection. Time spent fetching is charged to the
+    statement; the slow query check runs once the statement is done (no
+    result set, rows exhausted or next execute).
+    """
+    _statement: Optional[str] = None
+    _parameters: Any = ()
+    _elapsed: float = 0.0
+
+    def _charge(
+        self,
+        seconds: float,
+        rows: int = 0,
+        queries: int = 0
+    ) -> None:
+        self._elapsed += seconds
+        stats = current_trace.get()
+        if stats is not None:
+            stats.seconds += seconds
+            stats.rows += rows
+            stats.queries += queries
+
+    def _finish(self) -> None:
+        if self._statement is None:
+            return
+        if self._elapsed >= config.SLOW_QUERY_MS / 1000:
+            log_slow_query(
+                self.connection, self._statement, self._parameters,
+                self._elapsed
+                )
+        self._statement = None
+        self._elapsed = 0.0
+
+    def _run(
+        self,
+        method,
+        statement: str,
+        parameters: Any,
+        sample: Any,
+        runs: int = 1
+    ) -> "TracingCursor":
+        self._finish()
+        self._statement = statement
+        self._parameters = sample
+        start = time.perf_counter()
+        try:
+            return method(statement, parameters)
+        finally:
+            self._charge(
+                time.perf_counter() - start,
+                queries=runs if is_query(statement) else 0
+                )
+            if self.description is None:
+                self._finish()
+
+    def execute(self, statement: str, parameters: Any = ()):
+        return self._run(super().execute, statement, parameters, parameters)
+
+    def executemany(self, statement: str, seq_of_parameters: Iterable):
+        # Only the first row of parameters is kept for EXPLAIN
+        seq_of_parameters = list(seq_of_parameters)
+        sample = seq_of_parameters[0] if seq_of_parameters else ()
+        # Run once per row of parameters
+        return self._run(
+            super().executemany, statement, seq_of_parameters, sample,
+            len(seq_of_parameters)
+            )
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._charge(time.perf_counter() - start, row is not None)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size: Optional[int] = None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._charge(time.perf_counter() - start, len(rows))
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._charge(time.perf_counter() - start, len(rows))
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        super().close()
+
+
+class TracedConnection(sql.Connection):
+    """ Connection whose cursors and statements are traced """
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, statement: str, parameters: Any = ()):
+        return self.cursor().execute(statement, parameters)
+
+    def executemany(self, statement: str, seq_of_parameters: Iterable):
+        return self.cursor().executemany(statement, seq_of_parameters)
@@ -1,21 +1,52 @@
 # FastAPI
 from fastapi import FastAPI
 
+# Base data
+from database.funtionsDB import engine, export_pool
+from database.migrations import migrate
+
+# Security
+from security.passwords import password_hasher
+
 # Middlewares
+from middlewares.admission import AdmissionControl
 from middlewares.error_handler import ErrorHandler
+from middlewares.metrics import Instrumentation
+from middlewares.query_tracing import QueryTracing
 
 # Router
 from routes.user import user_router
 from routes.book import book_router
 from routes.home import home_router
 from routes.author import author_router
+from routes.login import login_router
 
 app = FastAPI()
 app.title = "Library"
 app.version = " 0.0.1"
 
+app.add_middleware(QueryTracing)
 app.add_middleware(ErrorHandler)
+# Outside the handlers and their errors, inside the metrics so that the
+# rejected requests are counted
+app.add_middleware(AdmissionControl, routes=app.routes)
+# Added last so it is the outermost middleware and times everything
+app.add_middleware(Instrumentation, routes=app.routes)
 app.include_router(home_router)
+app.include_router(login_router)
 app.include_router(user_router)
 app.include_router(book_router)
 app.include_router(author_router)
+
+
+@app.on_event("startup")
+def prepare_database() -> None:
+    # Pending schema migrations, a no-op once the database is current
+    engine.write(migrate)
+
+
+@app.on_event("shutdown")
+def stop_engine() -> None:
+    engine.stop()
+    export_pool.close()
+    password_hasher.stop()
@@ -0,0 +1,305 @@
+# Python
+import asyncio
+from collections import deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+# Starlette
+from starlette.routing import BaseRoute
+from starlette.types import ASGIApp, Receive, Scope, Send
+from fastapi.responses import JSONResponse
+
+# Config
+import config
+
+# Metrics
+from middlewares.metrics import Histogram, RouteMatcher, labels, registry
+
+# Served even under overload, so the server can still be watched
+EXEMPT_PATHS = frozenset((
+    '/', '/metrics', '/stats', '/docs', '/docs/oauth2-redirect', '/redoc',
+    '/openapi.json'
+    ))
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+
+
+class Limiter:
+    """ At most `limit` requests at once and `queue` more waiting in FIFO
+    order; None limit lets everything through. Only used from the event
+    loop.
+    - Args:
+      name: label in the metrics
+      limit: requests served at once
+      queue: requests allowed to wait for a slot
+    """
+
+    def __init__(self, name: str, limit: Optional[int], queue: int) -> None:
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.rejected = {'queue_full': 0, 'timeout': 0}
+        self.admitted = 0
+        self.wait = Histogram()
+
+    async def acquire(self, deadline: float) -> Optional[str]:
+        """ Take a slot, waiting until deadline (loop time) at the latest
+        - Returns:
+          None once admitted, otherwise why the request was rejected
+        """
+        if self.limit is None or (
+                self.active < self.limit and not self._waiters):
+            self.active += 1
+            self.admitted += 1
+            self.wait.observe(0.0)
+            return None
+        loop = asyncio.get_running_loop()
+        timeout = deadline - loop.time()
+        if len(self._waiters) >= self.queue:
+            self.rejected['queue_full'] += 1
+            return 'queue_full'
+        if timeout <= 0:
+            self.rejected['timeout'] += 1
+            return 'timeout'
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        start = loop.time()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Handed a slot just as the time ran out
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            self.rejected['timeout'] += 1
+            return 'timeout'
+        except asyncio.CancelledError:
+            # The client went away while queued
+            if waiter.done():
+                self.release()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            raise
+        self.admitted += 1
+        self.wait.observe(loop.time() - start)
+        return None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def release(self) -> None:
+        """ Hand the slot to the oldest waiter, or free it """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'limit': self.limit,
+            'queue': self.queue,
+            'active': self.active,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'rejected': dict(self.rejected),
+            }
+
+
+def parse_route_limits(text: str) -> Dict[Tuple[str, str], int]:
+    """ "POST /login=8,GET /books/export=2" -> {('POST', '/login'): 8...} """
+    limits = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        route, limit = item.rsplit('=', 1)
+        method, path = route.split()
+        limits[(method.upper(), path)] = int(limit)
+    return limits
+
+
+class Admission:
+    """ Per class and per route limits with queue time budgets
+
+    Reads (GET) and writes (other methods) have a limiter each, so a
+    flood of one class cannot take every slot of the other; routes with
+    an entry in route_limits also pass their own limiter first. A
+    request waits at most its class budget in total, then it is answered
+    with 503 and Retry-After instead of piling up on SQLite.
+    """
+
+    def __init__(
+        self,
+        read: Tuple[int, int, float],
+        write: Tuple[int, int, float],
+        route_limits: Dict[Tuple[str, str], int]
+    ) -> None:
+        self.classes: Dict[str, Limiter] = {}
+        self.budgets: Dict[str, float] = {}
+        classes = {'read': read, 'write': write}
+        for name, (limit, queue, budget) in classes.items():
+            self.classes[name] = Limiter(name, limit or None, queue)
+            self.budgets[name] = budget
+        # A limit of 0 turns the limit off, for classes and routes alike
+        self.routes = {
+            key: Limiter(f"{key[0]} {key[1]}", limit or None,
+                         self.classes[self.kind(key[0])].queue)
+            for key, limit in route_limits.items()
+            }
+
+    @staticmethod
+    def kind(method: str) -> str:
+        return 'read' if method in READ_METHODS else 'write'
+
+    async def admit(
+        self,
+        method: str,
+        path: str
+    ) -> Tuple[Optional[str], List[Limiter]]:
+        """ Take the slots of a request
+        - Args:
+          path: path template of the matched route
+        - Returns:
+          The rejection reason or None, and the limiters to release
+        """
+        kind = self.kind(method)
+        deadline = asyncio.get_running_loop().time() + self.budgets[kind]
+        limiters = [self.classes[kind]]
+        route = self.routes.get((method, path))
+        if route is not None:
+            limiters.insert(0, route)
+        taken: List[Limiter] = []
+        try:
+            for limiter in limiters:
+                reason = await limiter.acquire(deadline)
+                if reason is not None:
+                    self.release(taken)
+                    return reason, []
+                taken.append(limiter)
+        except BaseException:
+            self.release(taken)
+            raise
+        return None, taken
+
+    @staticmethod
+    def release(limiters: Sequence[Limiter]) -> None:
+        for limiter in reversed(limiters):
+            limiter.release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            **{name: limiter.stats()
+               for name, limiter in self.classes.items()},
+            'routes': {limiter.name: limiter.stats()
+                       for limiter in self.routes.values()},
+            }
+
+    def metrics(self) -> List[str]:
+        """ Prometheus lines for middlewares.metrics.registry """
+        limiters = [*self.classes.values(), *self.routes.values()]
+        lines = [
+            "# HELP admission_active Requests holding a slot.",
+            "# TYPE admission_active gauge",
+            ]
+        for limiter in limiters:
+            lines.append(
+                f"admission_active{labels(limiter=limiter.name)} "
+                f"{limiter.active}"
+                )
+        lines.extend([
+            "# HELP admission_waiting Requests queued for a slot.",
+            "# TYPE admission_waiting gauge",
+            ])
+        for limiter in limiters:
+            lines.append(
+                f"admission_waiting{labels(limiter=limiter.name)} "
+                f"{limiter.waiting}"
+                )
+        lines.extend([
+            "# HELP admission_rejected_total Requests answered with 503.",
+            "# TYPE admission_rejected_total counter",
+            ])
+        for limiter in limiters:
+            for reason, n in limiter.rejected.items():
+                lines.append(
+                    "admission_rejected_total"
+                    f"{labels(limiter=limiter.name, reason=reason)} {n}"
+                    )
+        lines.extend([
+            "# HELP admission_wait_seconds Time queued before admission.",
+            "# TYPE admission_wait_seconds histogram",
+            ])
+        for limiter in limiters:
+            lines.extend(limiter.wait.lines(
+                "admission_wait_seconds", limiter=limiter.name
+                ))
+        return lines
+
+
+admission = Admission(
+    read=(config.ADMISSION_READ_LIMIT, config.ADMISSION_READ_QUEUE,
+          config.ADMISSION_READ_WAIT_MS / 1000),
+    write=(config.ADMISSION_WRITE_LIMIT, config.ADMISSION_WRITE_QUEUE,
+           config.ADMISSION_WRITE_WAIT_MS / 1000),
+    route_limits=parse_route_limits(config.ADMISSION_ROUTE_LIMITS)
+    )
+registry.collect(admission.metrics)
+
+
+class AdmissionControl:
+    """ Pure ASGI middleware rejecting the requests that cannot get a
+    slot of `admission` in time with 503 and Retry-After
+
+    The route is matched here, before the router, so limits and metrics
+    use the path template (/author/{id_author}/books) and not the path.
+    - Args:
+      routes: the application routes, app.routes
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Sequence[BaseRoute],
+        controller: Admission = admission
+    ) -> None:
+        self.app = app
+        self.routes = routes
+        self.admission = controller
+        self.matcher = RouteMatcher(routes)
+
+    def match(self, scope: Scope) -> Optional[BaseRoute]:
+        return self.matcher.match(scope)
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        if scope['type'] != 'http' or scope['path'] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        route = self.match(scope)
+        if route is None:
+            # 404 / 405, answered by the router without any work
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        reason, taken = await self.admission.admit(method, route.path)
+        if reason is not None:
+            response = JSONResponse(
+                status_code=503,
+                content={'detail': "¡The server is busy, try again later!"},
+                headers={'Retry-After': '1'}
+                )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.admission.release(taken)
@@ -1,14 +1,56 @@
-from starlette.middleware.base import BaseHTTPMiddleware
-from fastapi import FastAPI, Request, Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 from fastapi.responses import JSONResponse
 
+# Base data
+from database.pool import PoolTimeout, is_busy
 
-class ErrorHandler(BaseHTTPMiddleware):
-    def __init__(self, app: FastAPI) -> None:
-        super().__init__(app)
 
-    async def dispatch(self, request: Request, call_next) -> Response | JSONResponse:
+class ErrorHandler:
+    """ Pure ASGI middleware turning unhandled errors into a JSON 500
+
+    A database still locked after the engine's retries, or a pool with no
+    free connection, is overload rather than a bug: it is answered with
+    503 and Retry-After so that clients back off.
+
+    Unlike BaseHTTPMiddleware it runs no extra task per request and
+    passes the response messages (streaming bodies included) straight
+    through.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        response_started = False
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_started
+            if message['type'] == 'http.response.start':
+                response_started = True
+            await send(message)
+
         try:
-            return await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except Exception as e:
-            return JSONResponse(status_code=500, content={'error': str(e)})
+            # Too late to change the status once the headers are out
+            if response_started:
+                raise
+            if isinstance(e, PoolTimeout) or is_busy(e):
+                response = JSONResponse(
+                    status_code=503,
+                    content={'error': str(e)},
+                    headers={'Retry-After': '1'}
+                    )
+            else:
+                response = JSONResponse(
+                    status_code=500, content={'error': str(e)}
+                    )
+            await response(scope, receive, send)
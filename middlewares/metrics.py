@@ -0,0 +1,220 @@
+# Python
+import time
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Starlette
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def escape(value: str) -> str:
+    """ Escape a label value for the text exposition format """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**values: str) -> str:
+    pairs = (f'{k}="{escape(v)}"' for k, v in values.items())
+    return '{' + ','.join(pairs) + '}'
+
+
+class Histogram:
+    """ Fixed bucket histogram, rendered cumulative like Prometheus """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str, **values: str) -> List[str]:
+        """ _bucket, _sum and _count samples of the metric name """
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += n
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(
+                f"{name}_bucket{labels(**values, le=le)} {cumulative}"
+                )
+        lines.append(f"{name}_sum{labels(**values)} {self.sum}")
+        lines.append(f"{name}_count{labels(**values)} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """ Request metrics per (method, templated route)
+
+    Only touched from the event loop, so no locking is needed. Other
+    components add their own samples with collect().
+    """
+
+    def __init__(self) -> None:
+        self.requests: Dict[Tuple[str, str, str], int] = defaultdict(int)
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.response_bytes: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.in_flight: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.collectors: List[Callable[[], List[str]]] = []
+
+    def collect(self, collector: Callable[[], List[str]]) -> None:
+        """ Append the lines returned by collector to every render """
+        self.collectors.append(collector)
+
+    def observe(
+        self,
+        method: str,
+        route: str,
+        status: int,
+        seconds: float,
+        size: int
+    ) -> None:
+        self.requests[(method, route, str(status))] += 1
+        key = (method, route)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.observe(seconds)
+        self.response_bytes[key] += size
+
+    def render(self) -> str:
+        """ Prometheus text exposition format (version 0.0.4) """
+        lines: List[str] = []
+        lines.append("# HELP http_requests_total Requests served.")
+        lines.append("# TYPE http_requests_total counter")
+        for (method, route, status), n in sorted(self.requests.items()):
+            lines.append(
+                "http_requests_total"
+                f"{labels(method=method, route=route, status=status)} {n}"
+                )
+        lines.append(
+            "# HELP http_request_duration_seconds Request latency."
+            )
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), h in sorted(self.latency.items()):
+            lines.extend(h.lines(
+                "http_request_duration_seconds", method=method, route=route
+                ))
+        lines.append(
+            "# HELP http_response_size_bytes_total Response body bytes."
+            )
+        lines.append("# TYPE http_response_size_bytes_total counter")
+        for (method, route), n in sorted(self.response_bytes.items()):
+            lines.append(
+                "http_response_size_bytes_total"
+                f"{labels(method=method, route=route)} {n}"
+                )
+        lines.append(
+            "# HELP http_requests_in_progress Requests being served."
+            )
+        lines.append("# TYPE http_requests_in_progress gauge")
+        for (method, route), n in sorted(self.in_flight.items()):
+            lines.append(
+                "http_requests_in_progress"
+                f"{labels(method=method, route=route)} {n}"
+                )
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class RouteMatcher:
+    """ Route of a request, matched before the router runs
+
+    The last matches are cached by (method, path), so a request costs a
+    dict lookup instead of a regex per route.
+    - Args:
+      routes: the application routes, app.routes
+      size: (method, path) pairs kept
+    """
+
+    def __init__(self, routes: Sequence[BaseRoute], size: int = 4096) -> None:
+        self.routes = routes
+        self.size = size
+        # (method, path) -> matched route, None for no route
+        self._matches: "OrderedDict[Tuple[str, str], Optional[BaseRoute]]"
+        self._matches = OrderedDict()
+
+    def match(self, scope: Scope) -> Optional[BaseRoute]:
+        key = (scope['method'], scope['path'])
+        if key in self._matches:
+            self._matches.move_to_end(key)
+            return self._matches[key]
+        found = None
+        for route in self.routes:
+            if route.matches(scope)[0] is Match.FULL:
+                found = route
+                break
+        self._matches[key] = found
+        if len(self._matches) > self.size:
+            self._matches.popitem(last=False)
+        return found
+
+
+class Instrumentation:
+    """ Pure ASGI middleware recording request count, latency, response
+    size and in-flight requests per templated route
+    - Args:
+      routes: the application routes, matched before the call so the
+      in-flight gauge has the route too
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        routes: Sequence[BaseRoute],
+        metrics: MetricsRegistry = registry
+    ) -> None:
+        self.app = app
+        self.metrics = metrics
+        self.matcher = RouteMatcher(routes)
+
+    async def __call__(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send
+    ) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        method = scope['method']
+        status = 500
+        size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        # The path template keeps the label cardinality bounded
+        route = self.matcher.match(scope)
+        path = getattr(route, 'path', None) or 'unmatched'
+        key = (method, path)
+        in_flight = self.metrics.in_flight
+        in_flight[key] += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight[key] -= 1
+            self.metrics.observe(
+                method, path, status, time.perf_counter() - start, size
+                )
@@ -0,0 +1,26 @@
+# Base data
+from repositories.base import Repository
+
+# Model
+from schemas.authors import AuthorBase
+
+author_table = Repository(
+    "Author", "id_author",
+    ("id_author", "name", "nationality", "genre", "birthdate"),
+    # A name match ranks above a genre match
+    search_index="Author_fts",
+    search_weights=(10.0, 1.0)
+    )
+
+
+def author_values(author: AuthorBase) -> tuple:
+    """ Row values of a new author for author_table.sql_insert """
+    birthdate = author.birthdate
+    if author.birthdate is not None:
+        birthdate = birthdate.strftime("%Y-%m-%d")
+    return (
+        author.name,
+        author.nationality,
+        author.genre,
+        birthdate
+        )
@@ -0,0 +1,261 @@
+# Python
+import re
+from datetime import date
+from enum import Enum
+from sqlite3 import Connection
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+from typing import Set, Tuple
+
+# Pydantic
+from pydantic import SecretStr
+
+# Base data
+from database.funtionsDB import chunks, placeholders
+from database.pagination import keyset_query, next_page
+
+
+def row_mapper(columns: Sequence[str]) -> Callable[[Sequence], Dict]:
+    """ row -> {column: value}, with the column names bound once """
+    keys = tuple(columns)
+
+    def to_dict(row: Sequence) -> Dict:
+        return dict(zip(keys, row))
+    return to_dict
+
+
+def adapt(value: Any) -> Any:
+    """ Model values (enums, dates, secrets) as stored in SQLite """
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    if isinstance(value, SecretStr):
+        return value.get_secret_value()
+    return value
+
+
+def match_expression(text: str) -> str:
+    """ FTS5 query matching every word of text, each one also as a
+    prefix; the words are quoted, so user input is never FTS5 syntax
+    - Raises:
+      ValueError if text has no word
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        raise ValueError("¡The search has no words!")
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class Repository:
+    """ Statements and row mapper of one table, built once at import
+
+    The SQL strings never change, so the statement cache of each sqlite3
+    connection prepares every one of them only once.
+    - Args:
+      table: table name
+      key: integer primary key
+      columns: every column, key first, in the order rows are returned
+      private: columns never sent in responses or exports
+      unique: column with a unique index, for insert_unique
+      nullable: sort columns that may be NULL, paged as ''
+      search_index: FTS5 table over some columns, for search
+      search_weights: BM25 weight of each column of search_index
+    """
+
+    def __init__(
+        self,
+        table: str,
+        key: str,
+        columns: Sequence[str],
+        private: Sequence[str] = (),
+        unique: Optional[str] = None,
+        nullable: Sequence[str] = (),
+        search_index: Optional[str] = None,
+        search_weights: Sequence[float] = ()
+    ) -> None:
+        self.table = table
+        self.key = key
+        self.columns = list(columns)
+        if self.columns[0] != key:
+            raise ValueError(f"¡{key} must be the first column!")
+        self.fields = self.columns[1:]
+        self.public = [c for c in self.columns if c not in private]
+        self.nullable = frozenset(nullable)
+        self.to_dict = row_mapper(self.columns)
+        self.public_dict = row_mapper(self.public)
+
+        select = ','.join(self.columns)
+        self.sql_select = f"SELECT {select} FROM {table} WHERE {key}=?"
+        self.sql_select_public = (
+            f"SELECT {','.join(self.public)} FROM {table} WHERE {key}=?"
+            )
+        self.sql_insert = (
+            f"INSERT INTO {table}({','.join(self.fields)}) "
+            f"VALUES({placeholders(self.fields)})"
+            )
+        self.sql_insert_unique = (
+            f"{self.sql_insert} ON CONFLICT({unique}) DO NOTHING "
+            f"RETURNING {key}"
+            ) if unique else None
+        self.sql_update = (
+            f"UPDATE {table} SET {', '.join(f'{c} = ?' for c in self.fields)}"
+            f" WHERE {key} = ?"
+            )
+        self.sql_delete = (
+            f"DELETE FROM {table} WHERE {key}=? RETURNING {select}"
+            )
+        if search_index:
+            weights = ''.join(f", {weight}" for weight in search_weights)
+            self.sql_search = (
+                f"SELECT {','.join(f'{table}.{c}' for c in self.columns)} "
+                f"FROM {search_index} "
+                f"JOIN {table} ON {table}.{key} = {search_index}.rowid "
+                f"WHERE {search_index} MATCH ? "
+                f"ORDER BY bm25({search_index}{weights}) LIMIT ? OFFSET ?"
+                )
+        # Partial UPDATE ... RETURNING statements by updated columns
+        self._sql_updates: Dict[Tuple[str, ...], str] = {}
+
+    # Reads
+    def get(self, conn: Connection, id: int) -> Optional[Dict]:
+        row = conn.execute(self.sql_select, (id,)).fetchone()
+        return None if row is None else self.to_dict(row)
+
+    def get_public(self, conn: Connection, id: int) -> Optional[Dict]:
+        row = conn.execute(self.sql_select_public, (id,)).fetchone()
+        return None if row is None else self.public_dict(row)
+
+    def get_many(
+        self,
+        conn: Connection,
+        ids: Iterable[int]
+    ) -> Dict[int, Dict]:
+        """ Rows of the existing ids, by id """
+        found = {}
+        select = ','.join(self.columns)
+        for chunk in chunks(list(set(ids))):
+            cur = conn.execute(
+                f"SELECT {select} FROM {self.table} "
+                f"WHERE {self.key} IN ({placeholders(chunk)})", chunk)
+            for row in cur:
+                found[row[0]] = self.to_dict(row)
+        return found
+
+    def page(
+        self,
+        conn: Connection,
+        sort: str,
+        cursor: Optional[str],
+        limit: int
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """ One keyset page of rows and the cursor of the next one
+        - Raises:
+          ValueError if the cursor is not valid
+        """
+        sql, params = keyset_query(
+            self.table, self.columns, self.key, sort, cursor, limit,
+            nullable=sort in self.nullable
+            )
+        rows = conn.execute(sql, params).fetchall()
+        return next_page(rows, self.columns, self.key, sort, limit)
+
+    def search(
+        self,
+        conn: Connection,
+        text: str,
+        limit: int,
+        offset: int = 0
+    ) -> Tuple[List[tuple], bool]:
+        """ Rows matching every word of text, best BM25 rank first
+        - Returns:
+          Up to limit rows and whether more rows follow
+        - Raises:
+          ValueError if text has no word
+        """
+        rows = conn.execute(
+            self.sql_search, (match_expression(text), limit + 1, offset)
+            ).fetchall()
+        return rows[:limit], len(rows) > limit
+
+    # Writes
+    def insert(self, conn: Connection, values: Sequence) -> int:
+        """ Insert one row of self.fields values, return its id """
+        return conn.execute(self.sql_insert, values).lastrowid
+
+    def insert_unique(
+        self,
+        conn: Connection,
+        values: Sequence
+    ) -> Optional[int]:
+        """ Insert one row unless its unique column is taken, in one
+        statement backed by the unique index
+        - Returns:
+          The new id, None on conflict
+        """
+        rows = conn.execute(self.sql_insert_unique, values).fetchall()
+        return rows[0][0] if rows else None
+
+    def insert_many(self, conn: Connection, rows: List[Sequence]) -> List[int]:
+        """ Insert rows with one executemany, return their ids in order """
+        if not rows:
+            return []
+        conn.executemany(self.sql_insert, rows)
+        # Rowids are contiguous: the writer thread is alone in the transaction
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return list(range(last - len(rows) + 1, last + 1))
+
+    def update_values(self, record: Dict) -> tuple:
+        """ Parameters of sql_update for a whole row as a dict """
+        return tuple(adapt(record[c]) for c in self.fields) + (
+            record[self.key],
+            )
+
+    def update_many(self, conn: Connection, records: Iterable[Dict]) -> None:
+        conn.executemany(self.sql_update, map(self.update_values, records))
+
+    def update(
+        self,
+        conn: Connection,
+        id: int,
+        changes: Dict[str, Any]
+    ) -> Optional[Dict]:
+        """ Set only the given columns of one row, in one statement
+        - Args:
+          changes: column -> new value, at least one column
+        - Returns:
+          The row after the update, None when it does not exist
+        """
+        columns = tuple(changes)
+        sql = self._sql_updates.get(columns)
+        if sql is None:
+            unknown = set(columns) - set(self.fields)
+            if unknown or not columns:
+                raise ValueError(f"¡Cannot update {sorted(unknown)}!")
+            sql = self._sql_updates[columns] = (
+                f"UPDATE {self.table} "
+                f"SET {', '.join(f'{c} = ?' for c in columns)} "
+                f"WHERE {self.key} = ? RETURNING {','.join(self.columns)}"
+                )
+        params = [adapt(value) for value in changes.values()]
+        params.append(id)
+        rows = conn.execute(sql, params).fetchall()
+        return self.to_dict(rows[0]) if rows else None
+
+    def delete(self, conn: Connection, id: int) -> Optional[Dict]:
+        """ Delete one row, in one statement
+        - Returns:
+          The deleted row, None when it did not exist
+        """
+        rows = conn.execute(self.sql_delete, (id,)).fetchall()
+        return self.to_dict(rows[0]) if rows else None
+
+    def delete_many(self, conn: Connection, ids: Iterable[int]) -> Set[int]:
+        """ Delete the existing ids, return the ones that were deleted """
+        deleted = set()
+        for chunk in chunks(list(set(ids))):
+            cur = conn.execute(
+                f"DELETE FROM {self.table} "
+                f"WHERE {self.key} IN ({placeholders(chunk)}) "
+                f"RETURNING {self.key}", chunk)
+            deleted.update(row[0] for row in cur.fetchall())
+        return deleted
@@ -0,0 +1,37 @@
+# Python
+from datetime import datetime
+
+# Base data
+from repositories.base import Repository
+
+# Model
+from schemas.book import BookBase
+
+book_table = Repository(
+    "Book", "id_book",
+    ("id_book", "title", "reading_age", "pages", "language", "publisher",
+     "date_add", "date_update"),
+    # Pages by COALESCE(title, ''), see migration 7
+    nullable=("title",),
+    # A title match ranks above a publisher match
+    search_index="Book_fts",
+    search_weights=(10.0, 1.0)
+    )
+
+
+def book_values(book: BookBase) -> tuple:
+    """ Row values of a new book for book_table.sql_insert """
+    if book.date_add is not None:
+        date_add = book.date_add.strftime("%Y-%m-%d")
+    else:
+        date_add = datetime.now().strftime("%Y-%m-%d")
+    date_update = date_add
+    return (
+        book.title,
+        book.reading_age.__str__(),
+        book.pages,
+        book.language.__str__(),
+        book.publisher,
+        date_add,
+        date_update
+        )
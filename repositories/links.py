@@ -0,0 +1,137 @@
+# Python
+from sqlite3 import Connection
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Base data
+from database.funtionsDB import chunks, placeholders
+from database.pagination import decode_cursor, next_page
+from repositories.base import Repository
+from repositories.author import author_table
+from repositories.book import book_table
+
+
+class Relation:
+    """ One direction of a many-to-many link table: the rows of target
+    linked to a given id
+
+    Every read is one JOIN through the link table index that starts with
+    source_column, so a page of related rows, or the related rows of a
+    whole page of ids, costs one query instead of one per row.
+    - Args:
+      table: link table name
+      key: integer primary key of the link table
+      source_column: link column holding the id the reads start from
+      target_column: link column holding the id of target
+      target: repository of the rows returned
+    """
+
+    def __init__(
+        self,
+        table: str,
+        key: str,
+        source_column: str,
+        target_column: str,
+        target: Repository
+    ) -> None:
+        self.table = table
+        self.target = target
+        columns = ','.join(f"t.{c}" for c in target.columns)
+        join = (
+            f"FROM {table} l JOIN {target.table} t "
+            f"ON t.{target.key} = l.{target_column}"
+            )
+        self.sql_link = (
+            f"INSERT INTO {table}({source_column}, {target_column}) "
+            f"VALUES(?, ?) "
+            f"ON CONFLICT({source_column}, {target_column}) DO NOTHING "
+            f"RETURNING {key}"
+            )
+        self.sql_unlink = (
+            f"DELETE FROM {table} "
+            f"WHERE {source_column} = ? AND {target_column} = ? "
+            f"RETURNING {key}"
+            )
+        self.sql_page = (
+            f"SELECT {columns} {join} "
+            f"WHERE l.{source_column} = ? AND l.{target_column} > ? "
+            f"ORDER BY l.{target_column} LIMIT ?"
+            )
+        self.sql_load = (
+            f"SELECT l.{source_column}, {columns} {join} "
+            f"WHERE l.{source_column} IN ({{}}) "
+            f"ORDER BY l.{source_column}, l.{target_column}"
+            )
+
+    # Reads
+    def page(
+        self,
+        conn: Connection,
+        id: int,
+        cursor: Optional[str],
+        limit: int
+    ) -> Tuple[List[tuple], Optional[str]]:
+        """ One keyset page of the target rows linked to id, by target key
+        - Raises:
+          ValueError if the cursor is not valid
+        """
+        key = self.target.key
+        last = 0 if cursor is None else decode_cursor(cursor, key)[1]
+        rows = conn.execute(self.sql_page, (id, last, limit + 1)).fetchall()
+        return next_page(rows, self.target.columns, key, key, limit)
+
+    def load(
+        self,
+        conn: Connection,
+        ids: Iterable[int]
+    ) -> Dict[int, List[Dict]]:
+        """ Target rows linked to each id, one query per chunk of ids
+        - Returns:
+          id -> list of target rows as dicts, [] for ids without links
+        """
+        ids = list(dict.fromkeys(ids))
+        related: Dict[int, List[Dict]] = {id: [] for id in ids}
+        to_dict = self.target.to_dict
+        for chunk in chunks(ids):
+            cur = conn.execute(
+                self.sql_load.format(placeholders(chunk)), chunk
+                )
+            for row in cur:
+                related[row[0]].append(to_dict(row[1:]))
+        return related
+
+    # Writes
+    def link(self, conn: Connection, id: int, target_id: int) -> bool:
+        """ Link target_id to id
+        - Returns:
+          False when they were already linked
+        - Raises:
+          sqlite3.IntegrityError if one of the two rows does not exist
+        """
+        return bool(conn.execute(self.sql_link, (id, target_id)).fetchall())
+
+    def unlink(self, conn: Connection, id: int, target_id: int) -> bool:
+        """ Remove the link, False when there was none """
+        rows = conn.execute(self.sql_unlink, (id, target_id)).fetchall()
+        return bool(rows)
+
+
+# Book_Author read from both sides, User_Book from the user side
+book_authors = Relation(
+    "Book_Author", "id_book_author", "fk_id_book", "fk_id_author",
+    author_table
+    )
+author_books = Relation(
+    "Book_Author", "id_book_author", "fk_id_author", "fk_id_book",
+    book_table
+    )
+user_books = Relation(
+    "User_Book", "id_user_book", "fk_id_user", "fk_id_book", book_table
+    )
+
+
+def with_authors(conn: Connection, books: List[Dict]) -> List[Dict]:
+    """ Add the 'authors' list to each book dict, in one batched read """
+    authors = book_authors.load(conn, (book['id_book'] for book in books))
+    for book in books:
+        book['authors'] = authors[book['id_book']]
+    return books
@@ -0,0 +1,60 @@
+# Python
+from sqlite3 import Connection
+from typing import Dict, Optional
+
+# Base data
+from repositories.base import Repository
+
+# Model
+from schemas.user import User
+
+# Table order; the password never leaves through the public mapper
+user_table = Repository(
+    "User", "id_user",
+    ("id_user", "firts_name", "last_name", "email", "password",
+     "birth_date"),
+    private=("password",),
+    unique="email"
+    )
+
+sql_select_by_email = (
+    f"SELECT {','.join(user_table.columns)} FROM User WHERE email=?"
+    )
+
+
+def user_values(user: User, password: str) -> tuple:
+    """ Row values of a new user for user_table.sql_insert
+    - Args:
+      password: the hash stored in place of user.password
+    """
+    if user.birth_date is not None:
+        birth_date = user.birth_date.strftime("%Y-%m-%d")
+    else:
+        birth_date = None
+    return (
+        user.firts_name,
+        user.last_name,
+        user.email,
+        password,
+        birth_date
+        )
+
+
+def get_by_email(conn: Connection, email: str) -> Optional[Dict]:
+    """ The user with this email, password hash included """
+    row = conn.execute(sql_select_by_email, (email,)).fetchone()
+    return None if row is None else user_table.to_dict(row)
+
+
+def replace_password(
+    conn: Connection,
+    id_user: int,
+    old: str,
+    new: str
+) -> bool:
+    """ Store a rehashed password, unless the password changed meanwhile """
+    cur = conn.execute(
+        "UPDATE User SET password=? WHERE id_user=? AND password=?",
+        (new, id_user, old)
+        )
+    return cur.rowcount > 0
@@ -1,51 +1,69 @@
 # Python
-from typing import List
+from functools import partial
+from typing import List, Dict, Optional, Tuple
+from sqlite3 import Connection
+
+# Config
+import config
 
 # Base data
-from database.funtionsDB import connectionDB
+from database.funtionsDB import engine, export_pool
+from database.funtionsDB import author_cache
+from database.export import ExportFormat, MEDIA_TYPES, export_rows
+from database.pagination import page_headers, offset_headers
+from repositories.author import author_table, author_values
+from repositories.book import book_table
+from repositories.links import author_books, with_authors
+from routes.params import current_user, id_list
 
 # FastAPI
 from fastapi import status
-from fastapi import Body, Query
+from fastapi import Body, Query, Depends, Path
 from fastapi import HTTPException
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi import APIRouter
 
 # Model
-from schemas.authors import AuthorBase, AuthorUpdate
+from schemas.authors import AuthorBase, AuthorUpdate, AuthorSort
+from schemas.authors import AuthorResult
+from schemas.authors import AuthorBatch
+from schemas.book import BookInclude, LinkedBook
+from schemas.serializers import ModelSerializer, RowSerializer
 
 author_router = APIRouter()
 
+# Encodes list pages when config.FAST_JSON is set
+author_list_serializer = RowSerializer(AuthorBase, author_table.columns)
+# Validate and encode the large responses in the threadpool
+author_page_serializer = ModelSerializer(List[AuthorBase])
+author_search_serializer = ModelSerializer(List[AuthorResult])
+author_batch_serializer = ModelSerializer(AuthorBatch)
+author_books_serializer = ModelSerializer(
+    List[LinkedBook], exclude_unset=True
+    )
+
 
 # Author
 # Create an Author
 @author_router.post(
     path="/author/new",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_201_CREATED,
     tags=["Author"],
     response_model=AuthorBase,
     summary="Create a new author"
     )
-def create_author(author: AuthorBase = Body(...)) -> AuthorBase:
+async def create_author(author: AuthorBase = Body(...)) -> AuthorBase:
     """
     It creates an author
     """
-    conn = connectionDB()
-    sql = ''' INSERT INTO Author(name,nationality,genre,birthdate)
-              VALUES(?,?,?,?) '''
-    birthdate = author.birthdate
-    if author.birthdate is not None:
-        birthdate = birthdate.strftime("%Y-%m-%d")
-    data = (
-        author.name,
-        author.nationality,
-        author.genre,
-        birthdate
-        )
-    cur = conn.cursor()
-    cur.execute(sql, data)
-    id_author = cur.lastrowid
-    conn.commit()
-    conn.close()
+    data = author_values(author)
+
+    def insert(conn: Connection) -> int:
+        return author_table.insert(conn, data)
+
+    id_author = await engine.write_async(insert)
     results = author.dict()
     results.update({'id_author': id_author})
     return results
@@ -59,22 +77,99 @@ def create_author(author: AuthorBase = Body(...)) -> AuthorBase:
     response_model=List[AuthorBase],
     tags=["Author"]
 )
-def show_all_authors() -> List[AuthorBase]:
-    """
-    Shows all authors
-    """
-    conn = connectionDB()
-    cur = conn.cursor()
-    colums = 'id_author,name,nationality,genre,birthdate'
-    cur.execute(f"SELECT {colums} FROM Author")
-    rows = cur.fetchall()
-    conn.close()
-    list_keys = colums.split(',')
-    results = list(
-        map(
-            lambda x: {list_keys[i]: x[i] for i in range(len(x))}, rows)
+async def show_all_authors(
+    request: Request,
+    limit: int = Query(
+        default=100,
+        ge=1,
+        le=1000,
+        title="Page size"
+        ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Page cursor",
+        description="X-Next-Cursor header of the previous page"
+        ),
+    sort: AuthorSort = Query(
+        default=AuthorSort.id_author,
+        title="Sort key"
+        )
+) -> List[AuthorBase]:
+    """
+    Shows all authors, one keyset page at a time; the cursor of the
+    next page is sent in the X-Next-Cursor and Link headers
+    """
+    try:
+        rows, next_cursor = await engine.read_shared(
+            ('authors', sort.value, cursor, limit),
+            author_table.page, sort.value, cursor, limit
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    headers = page_headers(request.url, next_cursor)
+    if config.FAST_JSON:
+        return Response(
+            author_list_serializer.render(rows),
+            media_type="application/json",
+            headers=headers
+            )
+    return await author_page_serializer.response(
+        list(map(author_table.to_dict, rows)), headers
+        )
+
+
+# Search Authors
+@author_router.get(
+    path="/authors/search",
+    status_code=status.HTTP_200_OK,
+    summary="Search authors by name and genre",
+    response_model=List[AuthorResult],
+    tags=["Author"]
+)
+async def search_authors(
+    request: Request,
+    q: str = Query(
+        ...,
+        min_length=1,
+        max_length=200,
+        title="Search text",
+        description="Every word must match the name and genre, "
+        "also as the start of a longer word"
+        ),
+    limit: int = Query(
+        default=20,
+        ge=1,
+        le=100,
+        title="Page size"
+        ),
+    offset: int = Query(
+        default=0,
+        ge=0,
+        le=10000,
+        title="Results to skip"
+        )
+) -> List[AuthorResult]:
+    """
+    Full-text search on the FTS5 index, best BM25 match first; the
+    offset of the next page is sent in the X-Next-Offset and Link headers
+    """
+    try:
+        rows, more = await engine.read_shared(
+            ('authors search', q, limit, offset),
+            author_table.search, q, limit, offset
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    return await author_search_serializer.response(
+        list(map(author_table.to_dict, rows)),
+        offset_headers(request.url, offset, limit, more)
         )
-    return results
 
 
 # Read a Author
@@ -85,7 +180,7 @@ def show_all_authors() -> List[AuthorBase]:
     response_model=AuthorBase,
     summary="Show details about an author"
     )
-def show_author(
+async def show_author(
     id_author: int = Query(
         ...,
         gt=0,
@@ -93,109 +188,300 @@ def show_author(
         description="Author id unique"
         )
 ) -> AuthorBase:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = 'id_author,name,nationality,genre,birthdate'
-    cur.execute(f"SELECT {features} FROM Author WHERE id_author=?",
-                (id_author,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    results = await author_cache.get_or_load_async(
+        id_author, engine.shared_loader('author', author_table.get)
+        )
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The author does not exists!"
             )
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
     return results
 
 
+# Read many authors
+@author_router.get(
+    path="/authors/batch",
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_model=AuthorBatch,
+    summary="Show many authors by id"
+    )
+async def show_authors_batch(ids: List[int] = Depends(id_list)) -> AuthorBatch:
+    """
+    Cached authors come from author_cache and the rest from one IN (...)
+    query; items keep the order of ids, unknown ids are listed in missing
+    """
+    found = await author_cache.get_many_or_load_async(
+        ids, partial(engine.read_async, author_table.get_many)
+        )
+    return await author_batch_serializer.response({
+        'items': [found[id] for id in ids if id in found],
+        'missing': [id for id in ids if id not in found]
+        })
+
+
+# Read the books of an author
+@author_router.get(
+    path="/author/{id_author}/books",
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_model=List[LinkedBook],
+    response_model_exclude_unset=True,
+    summary="Shows the books of an author"
+    )
+async def show_author_books(
+    request: Request,
+    id_author: int = Path(
+        ...,
+        gt=0,
+        title="Author id",
+        description="Author id unique"
+        ),
+    limit: int = Query(
+        default=100,
+        ge=1,
+        le=1000,
+        title="Page size"
+        ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Page cursor",
+        description="X-Next-Cursor header of the previous page"
+        ),
+    include: Optional[BookInclude] = Query(
+        default=None,
+        title="Related rows",
+        description="authors: every author of each book, in one query "
+        "for the whole page"
+        )
+) -> List[LinkedBook]:
+    """
+    Books by id, one keyset page of a single JOIN at a time; the cursor
+    of the next page is sent in the X-Next-Cursor and Link headers
+    """
+    def read(conn: Connection) -> Tuple[Optional[List], Optional[str]]:
+        rows, next_cursor = author_books.page(
+            conn, id_author, cursor, limit
+            )
+        # Only an empty page needs to tell an unknown author apart
+        if not rows and author_table.get(conn, id_author) is None:
+            return None, None
+        books = list(map(book_table.to_dict, rows))
+        if include is BookInclude.authors:
+            with_authors(conn, books)
+        return books, next_cursor
+
+    try:
+        books, next_cursor = await engine.read_shared(
+            ('author books', id_author, cursor, limit, include), read
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    if books is None:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The author does not exists!"
+            )
+    return await author_books_serializer.response(
+        books, page_headers(request.url, next_cursor)
+        )
+
+
 # Update a Author
 @author_router.put(
     path="/author/update",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_200_OK,
     tags=["Author"],
     response_model=AuthorBase,
     summary="Updates an author"
     )
-def update_author(author: AuthorUpdate = Body(...)) -> AuthorBase:
-    autUp = author.dict()
-    [autUp.pop(b) for b in autUp.copy() if autUp.get(b) is None]
-    authorUpdate = autUp
+async def update_author(author: AuthorUpdate = Body(...)) -> AuthorBase:
+    """
+    Only the features sent are written, in one UPDATE ... RETURNING
+    """
+    authorUpdate = author.dict(exclude_unset=True, exclude_none=True)
     if len(authorUpdate) < 2:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡It is necessary a feature to change!"
             )
-    conn = connectionDB()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM Author WHERE id_author=?",
-                (authorUpdate['id_author'],))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    authorUpdate.pop('id_author')
+
+    def update(conn: Connection) -> Optional[dict]:
+        return author_table.update(conn, author.id_author, authorUpdate)
+
+    results = await engine.write_async(update)
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The author does not exists!"
             )
-    features = 'id_author,name,nationality,genre,birthdate'
-    list_keys = features.split(',')
-    row = rows[0]
-    dataUpdate = {list_keys[i]: row[i] for i in range(len(row))}
-    dataUpdate.update(authorUpdate)
-    sql = ''' UPDATE Author
-              SET name = ? ,
-                  nationality = ? ,
-                  genre = ?,
-                  birthdate = ?
-              WHERE id_author = ?'''
-    values = (
-        dataUpdate['name'],
-        dataUpdate['nationality'],
-        dataUpdate['genre'],
-        dataUpdate['birthdate'],
-        dataUpdate['id_author']
-    )
-    cur.execute(sql, values)
-    conn.commit()
-    conn.close()
-    return dataUpdate
+    author_cache.invalidate(author.id_author)
+    return results
 
 
 # Delete a Author
 @author_router.delete(
     path="/author/delete",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_200_OK,
     summary="Delete an author",
     response_model=dict,
     tags=["Author"]
 )
-def delete_an_author(id_author: int = Query(
+async def delete_an_author(id_author: int = Query(
         ...,
         gt=0,
         title="Author id",
         description="Author id unique"
         )
 ) -> dict:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = 'id_author,name,nationality,genre,birthdate'
-    cur.execute(f"SELECT {features} FROM Author WHERE id_author=?",
-                (id_author,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    def delete(conn: Connection) -> Optional[dict]:
+        return author_table.delete(conn, id_author)
+
+    results = await engine.write_async(delete)
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The author does not exists!"
             )
-    sql = 'DELETE FROM Author WHERE id_author=?'
-    cur.execute(sql, (id_author,))
-    conn.commit()
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
+    author_cache.invalidate(id_author)
     return results
+
+
+# Bulk
+# Create authors
+@author_router.post(
+    path="/authors/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_model=List[Dict],
+    summary="Create many authors in one transaction"
+    )
+async def create_authors(authors: List[AuthorBase] = Body(...)) -> List[Dict]:
+    """
+    It creates every author with one executemany and returns the new ids
+    in the same order
+    """
+    data = [author_values(author) for author in authors]
+
+    def insert(conn: Connection) -> List[int]:
+        return author_table.insert_many(conn, data)
+
+    ids = await engine.write_async(insert)
+    return [
+        {'index': i, 'id_author': id_author, 'status': 'created'}
+        for i, id_author in enumerate(ids)
+        ]
+
+
+# Update authors
+@author_router.put(
+    path="/authors/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_model=List[Dict],
+    summary="Update many authors in one transaction"
+    )
+async def update_authors(
+    authors: List[AuthorUpdate] = Body(...)
+) -> List[Dict]:
+    """
+    It updates every existing author with one executemany; unknown ids
+    and items without changes are reported per item
+    """
+    def update(conn: Connection) -> List[Dict]:
+        current = author_table.get_many(
+            conn, (author.id_author for author in authors)
+            )
+        results = []
+        for i, author in enumerate(authors):
+            result = {'index': i, 'id_author': author.id_author}
+            authorUpdate = author.dict(exclude_unset=True, exclude_none=True)
+            if len(authorUpdate) < 2:
+                result['error'] = "¡It is necessary a feature to change!"
+            elif author.id_author not in current:
+                result['error'] = "¡The author does not exists!"
+            else:
+                current[author.id_author].update(authorUpdate)
+                result['status'] = 'updated'
+            results.append(result)
+        changed = {r['id_author'] for r in results if 'status' in r}
+        author_table.update_many(
+            conn, (current[id_author] for id_author in changed)
+            )
+        return results
+
+    results = await engine.write_async(update)
+    author_cache.invalidate(
+        *(r['id_author'] for r in results if 'status' in r)
+        )
+    return results
+
+
+# Delete authors
+@author_router.delete(
+    path="/authors/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_model=List[Dict],
+    summary="Delete many authors in one transaction"
+    )
+async def delete_authors(ids: List[int] = Body(...)) -> List[Dict]:
+    """
+    It deletes every existing author with one DELETE ... RETURNING per
+    chunk of ids
+    """
+    def delete(conn: Connection) -> List[Dict]:
+        found = author_table.delete_many(conn, ids)
+        return [
+            {'index': i, 'id_author': id_author, 'status': 'deleted'}
+            if id_author in found else
+            {'index': i, 'id_author': id_author,
+             'error': "¡The author does not exists!"}
+            for i, id_author in enumerate(ids)
+            ]
+
+    results = await engine.write_async(delete)
+    author_cache.invalidate(
+        *(r['id_author'] for r in results if 'status' in r)
+        )
+    return results
+
+
+# Export
+@author_router.get(
+    path="/authors/export",
+    status_code=status.HTTP_200_OK,
+    tags=["Author"],
+    response_class=StreamingResponse,
+    summary="Export all authors"
+    )
+async def export_authors(
+    format: ExportFormat = Query(
+        default=ExportFormat.ndjson,
+        title="Output format"
+        )
+) -> StreamingResponse:
+    """
+    Streams every author as NDJSON or CSV
+    """
+    return StreamingResponse(
+        export_rows(
+            export_pool, author_table.table, author_table.public,
+            author_table.key, format
+            ),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            'Content-Disposition':
+            f'attachment; filename="authors.{format.value}"'
+            }
+        )
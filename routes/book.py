@@ -1,60 +1,116 @@
 # Python
-from typing import List
-from datetime import datetime
+import hashlib
+from functools import partial
+from typing import List, Dict, Optional, Tuple
+from sqlite3 import Connection, IntegrityError
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
 
 # FastAPI
 from fastapi import APIRouter
 from fastapi import status
-from fastapi import Body, Query
+from fastapi import Body, Query, Depends
 from fastapi import HTTPException
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+# Config
+import config
 
 # Base data
-from database.funtionsDB import connectionDB
+from database.funtionsDB import engine, export_pool
+from database.funtionsDB import book_cache
+from database.export import ExportFormat, MEDIA_TYPES, export_rows
+from database.pagination import page_headers, offset_headers
+from repositories.book import book_table, book_values
+from repositories.links import book_authors, with_authors
+from routes.params import current_user, id_list
 
 # Model
-from schemas.book import BookBase, BookUpdate
+from schemas.book import BookBase, BookUpdate, BookSort, BookResult
+from schemas.book import BookInclude, BookDetails, BookAuthorLink
+from schemas.book import BookBatch
+from schemas.serializers import ModelSerializer, RowSerializer
 
 book_router = APIRouter()
 
+# Encodes list pages when config.FAST_JSON is set
+book_list_serializer = RowSerializer(BookBase, book_table.columns)
+# Validate and encode the large responses in the threadpool
+book_page_serializer = ModelSerializer(List[BookDetails], exclude_unset=True)
+book_search_serializer = ModelSerializer(List[BookResult])
+book_batch_serializer = ModelSerializer(BookBatch)
+
+
+# Funtions
+def book_etag(rows: List[tuple], *extra) -> str:
+    """ Strong ETag from the raw row values, no body serialization """
+    digest = hashlib.sha1(repr((rows, extra)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def http_date(date_update: Optional[str]) -> Optional[str]:
+    """ Last-Modified value of a YYYY-MM-DD date_update
+
+    date_update only keeps the day, so while it is today the book can
+    still change without moving it: no Last-Modified is sent then, and a
+    Last-Modified sent later is past every change of that day
+    """
+    if date_update == datetime.now().strftime("%Y-%m-%d"):
+        return None
+    try:
+        day = datetime.strptime(str(date_update), "%Y-%m-%d")
+    except ValueError:
+        return None
+    return format_datetime(day.replace(tzinfo=timezone.utc), usegmt=True)
+
+
+def not_modified(
+    request: Request,
+    etag: str,
+    last_modified: Optional[str]
+) -> bool:
+    """ True when the client copy is fresh: If-None-Match wins over
+    If-Modified-Since as in RFC 9110
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix('W/') for t in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    return parsedate_to_datetime(last_modified) <= since
+
 
 # Book
 # Create a Book
 @book_router.post(
     path="/book/new",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_201_CREATED,
     tags=["Book"],
     response_model=BookBase,
     summary="Create a new book"
     )
-def create_book(book: BookBase = Body(...)) -> BookBase:
+async def create_book(book: BookBase = Body(...)) -> BookBase:
     """
     It creates a user
     """
-    conn = connectionDB()
-    sql = ''' INSERT INTO Book(title,reading_age,pages, \
-    language,publisher,date_add,date_update)
-              VALUES(?,?,?,?,?,?,?) '''
-    if book.date_add is not None:
-        date_add = book.date_add.strftime("%Y-%m-%d")
-    else:
-        date_add = datetime.now().strftime("%Y-%m-%d")
-    date_update = date_add
-    data = (
-        book.title,
-        book.reading_age.__str__(),
-        book.pages,
-        book.language.__str__(),
-        book.publisher,
-        date_add,
-        date_update
-        )
-    cur = conn.cursor()
-    cur.execute(sql, data)
-    id_book = cur.lastrowid
-    conn.commit()
-    conn.close()
+    data = book_values(book)
+
+    def insert(conn: Connection) -> int:
+        return book_table.insert(conn, data)
+
+    id_book = await engine.write_async(insert)
     results = book.dict()
-    results.update({'id_book': id_book, 'date_update': date_add})
+    results.update({'id_book': id_book, 'date_update': data[5]})
     return results
 
 
@@ -63,26 +119,126 @@ def create_book(book: BookBase = Body(...)) -> BookBase:
     path="/books",
     status_code=status.HTTP_200_OK,
     summary="Shows all books",
-    response_model=List[BookBase],
+    response_model=List[BookDetails],
+    response_model_exclude_unset=True,
     tags=["Book"]
 )
-def show_all_books() -> List[BookBase]:
-    """
-    Shows all books
-    """
-    conn = connectionDB()
-    cur = conn.cursor()
-    colums = "id_book,title,reading_age,pages,"\
-        "language,publisher,date_add,date_update"
-    cur.execute(f"SELECT {colums} FROM Book")
-    rows = cur.fetchall()
-    conn.close()
-    list_keys = colums.split(',')
-    results = list(
-        map(
-            lambda x: {list_keys[i]: x[i] for i in range(len(x))}, rows)
+async def show_all_books(
+    request: Request,
+    limit: int = Query(
+        default=100,
+        ge=1,
+        le=1000,
+        title="Page size"
+        ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Page cursor",
+        description="X-Next-Cursor header of the previous page"
+        ),
+    sort: BookSort = Query(
+        default=BookSort.id_book,
+        title="Sort key"
+        ),
+    include: Optional[BookInclude] = Query(
+        default=None,
+        title="Related rows",
+        description="authors: the authors of each book, in one query "
+        "for the whole page"
+        )
+) -> List[BookDetails]:
+    """
+    Shows all books, one keyset page at a time; the cursor of the
+    next page is sent in the X-Next-Cursor and Link headers
+    """
+    def read(conn: Connection) -> Tuple[List[tuple], Optional[str], List]:
+        rows, next_cursor = book_table.page(
+            conn, sort.value, cursor, limit
+            )
+        books = list(map(book_table.to_dict, rows))
+        if include is BookInclude.authors:
+            with_authors(conn, books)
+        return rows, next_cursor, books
+
+    try:
+        rows, next_cursor, books = await engine.read_shared(
+            ('books', sort.value, cursor, limit, include), read
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    authors = []
+    if include is BookInclude.authors:
+        authors = [
+            [tuple(a.values()) for a in book['authors']] for book in books
+            ]
+    headers = page_headers(request.url, next_cursor)
+    # No Last-Modified: deletes, inserts and reorders of the page do not
+    # move the date_update of its rows, the ETag covers them
+    headers['ETag'] = book_etag(rows, next_cursor, *authors)
+    if not_modified(request, headers['ETag'], None):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
+    if config.FAST_JSON and include is None:
+        return Response(
+            book_list_serializer.render(rows),
+            media_type="application/json",
+            headers=headers
+            )
+    return await book_page_serializer.response(books, headers)
+
+
+# Search Books
+@book_router.get(
+    path="/books/search",
+    status_code=status.HTTP_200_OK,
+    summary="Search books by title and publisher",
+    response_model=List[BookResult],
+    tags=["Book"]
+)
+async def search_books(
+    request: Request,
+    q: str = Query(
+        ...,
+        min_length=1,
+        max_length=200,
+        title="Search text",
+        description="Every word must match the title and publisher, "
+        "also as the start of a longer word"
+        ),
+    limit: int = Query(
+        default=20,
+        ge=1,
+        le=100,
+        title="Page size"
+        ),
+    offset: int = Query(
+        default=0,
+        ge=0,
+        le=10000,
+        title="Results to skip"
+        )
+) -> List[BookResult]:
+    """
+    Full-text search on the FTS5 index, best BM25 match first; the
+    offset of the next page is sent in the X-Next-Offset and Link headers
+    """
+    try:
+        rows, more = await engine.read_shared(
+            ('books search', q, limit, offset),
+            book_table.search, q, limit, offset
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    return await book_search_serializer.response(
+        list(map(book_table.to_dict, rows)),
+        offset_headers(request.url, offset, limit, more)
         )
-    return results
 
 
 # Read a book
@@ -90,124 +246,346 @@ def show_all_books() -> List[BookBase]:
     path="/book/details",
     status_code=status.HTTP_200_OK,
     tags=["Book"],
-    response_model=BookBase,
+    response_model=BookDetails,
+    response_model_exclude_unset=True,
     summary="Show details about a book"
     )
-def show_book(
+async def show_book(
+    request: Request,
+    response: Response,
     id_book: int = Query(
         ...,
         gt=0,
         title="Book id",
         description="Book id unique"
+        ),
+    include: Optional[BookInclude] = Query(
+        default=None,
+        title="Related rows",
+        description="authors: the authors of the book"
         )
-) -> BookBase:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = "id_book,title,reading_age,pages,"\
-        "language,publisher,date_add,date_update"
-    cur.execute(f"SELECT {features} FROM Book WHERE id_book=?", (id_book,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+) -> BookDetails:
+    """
+    Answers 304 Not Modified when If-None-Match or If-Modified-Since
+    match the current ETag / Last-Modified of the book
+    """
+    results = await book_cache.get_or_load_async(
+        id_book, engine.shared_loader('book', book_table.get)
+        )
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The book does not exists!"
             )
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
+    row = tuple(results.values())
+    authors = []
+    if include is BookInclude.authors:
+        # A copy: the cached dict is shared between requests
+        results = dict(results)
+        linked = await engine.read_shared(
+            ('book authors', id_book), book_authors.load, [id_book]
+            )
+        results['authors'] = linked[id_book]
+        authors = [tuple(a.values()) for a in results['authors']]
+    headers = {'ETag': book_etag([row], *authors)}
+    last_modified = http_date(results['date_update'])
+    if last_modified is not None and include is None:
+        headers['Last-Modified'] = last_modified
+    if not_modified(request, headers['ETag'], headers.get('Last-Modified')):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                        headers=headers)
+    response.headers.update(headers)
     return results
 
 
+# Read many books
+@book_router.get(
+    path="/books/batch",
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_model=BookBatch,
+    summary="Show many books by id"
+    )
+async def show_books_batch(ids: List[int] = Depends(id_list)) -> BookBatch:
+    """
+    Cached books come from book_cache and the rest from one IN (...)
+    query; items keep the order of ids, unknown ids are listed in missing
+    """
+    found = await book_cache.get_many_or_load_async(
+        ids, partial(engine.read_async, book_table.get_many)
+        )
+    return await book_batch_serializer.response({
+        'items': [found[id] for id in ids if id in found],
+        'missing': [id for id in ids if id not in found]
+        })
+
+
 # Update a book
 @book_router.put(
     path="/book/update",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_200_OK,
     tags=["Book"],
     response_model=BookBase,
     summary="Updates a book"
     )
-def update_book(book: BookUpdate = Body(...)) -> BookBase:
-    bookUpdate = book.dict()
-    [bookUpdate.pop(b) for b in bookUpdate.copy() if bookUpdate.get(b) is None]
+async def update_book(book: BookUpdate = Body(...)) -> BookBase:
+    """
+    Only the features sent are written, in one UPDATE ... RETURNING
+    """
+    # Unset fields keep their stored value instead of the model defaults;
+    # date_update is set below, it does not count as a change
+    bookUpdate = book.dict(
+        exclude_unset=True, exclude_none=True, exclude={'date_update'}
+        )
     if len(bookUpdate) < 2:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡It is necessary a feature to change!"
             )
-    conn = connectionDB()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM Book WHERE id_book=?", (book.id_book,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    bookUpdate.pop('id_book')
+    bookUpdate['date_update'] = datetime.now().strftime("%Y-%m-%d")
+
+    def update(conn: Connection) -> Optional[dict]:
+        return book_table.update(conn, book.id_book, bookUpdate)
+
+    results = await engine.write_async(update)
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The book does not exists!"
             )
-    features = "id_book,title,reading_age,pages,\
-language,publisher,date_add,date_update"
-    list_keys = features.split(',')
-    row = rows[0]
-    dataUpdate = {list_keys[i]: row[i] for i in range(len(row))}
-    dataUpdate.update(bookUpdate)
-    sql = ''' UPDATE Book
-              SET title = ? ,
-                  reading_age = ? ,
-                  pages = ?,
-                  language = ?,
-                  publisher = ?,
-                  date_add = ?,
-                  date_update = ?
-              WHERE id_book = ?'''
-    values = (
-        dataUpdate['title'],
-        dataUpdate['reading_age'].__str__(),
-        dataUpdate['pages'],
-        dataUpdate['language'].__str__(),
-        dataUpdate['publisher'],
-        dataUpdate['date_add'],
-        datetime.now().strftime("%Y-%m-%d"),
-        dataUpdate['id_book']
-    )
-    cur.execute(sql, values)
-    conn.commit()
-    conn.close()
-    return dataUpdate
+    book_cache.invalidate(book.id_book)
+    return results
 
 
 # Delete a book
 @book_router.delete(
     path="/book/delete",
+    dependencies=[Depends(current_user)],
     status_code=status.HTTP_200_OK,
     summary="Delete a book",
     response_model=dict,
     tags=["Book"]
 )
-def delete_a_book(id_book: int = Query(
+async def delete_a_book(id_book: int = Query(
         ...,
         gt=0,
         title="Book id",
         description="Book id unique"
         )
 ) -> dict:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = "id_book,title,date_add,date_update"
-    cur.execute(f"SELECT {features} FROM Book WHERE id_book=?", (id_book,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    features = ('id_book', 'title', 'date_add', 'date_update')
+
+    def delete(conn: Connection) -> Optional[dict]:
+        return book_table.delete(conn, id_book)
+
+    row = await engine.write_async(delete)
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The book does not exists!"
             )
-    sql = 'DELETE FROM Book WHERE id_book=?'
-    cur.execute(sql, (id_book,))
-    conn.commit()
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
+    book_cache.invalidate(id_book)
+    return {feature: row[feature] for feature in features}
+
+
+# Authors of a book
+# Link an author
+@book_router.post(
+    path="/book/author/link",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_201_CREATED,
+    tags=["Book"],
+    response_model=dict,
+    summary="Add an author to a book"
+    )
+async def link_book_author(link: BookAuthorLink = Body(...)) -> dict:
+    def insert(conn: Connection) -> bool:
+        return book_authors.link(conn, link.id_book, link.id_author)
+
+    try:
+        linked = await engine.write_async(insert)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The book or the author does not exists!"
+            )
+    if not linked:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The author is already linked to the book!"
+            )
+    return {'id_book': link.id_book, 'id_author': link.id_author,
+            'status': 'linked'}
+
+
+# Unlink an author
+@book_router.delete(
+    path="/book/author/unlink",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_model=dict,
+    summary="Remove an author from a book"
+    )
+async def unlink_book_author(
+    id_book: int = Query(
+        ...,
+        gt=0,
+        title="Book id"
+        ),
+    id_author: int = Query(
+        ...,
+        gt=0,
+        title="Author id"
+        )
+) -> dict:
+    def delete(conn: Connection) -> bool:
+        return book_authors.unlink(conn, id_book, id_author)
+
+    if not await engine.write_async(delete):
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The author is not linked to the book!"
+            )
+    return {'id_book': id_book, 'id_author': id_author,
+            'status': 'unlinked'}
+
+
+# Bulk
+# Create books
+@book_router.post(
+    path="/books/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_model=List[Dict],
+    summary="Create many books in one transaction"
+    )
+async def create_books(books: List[BookBase] = Body(...)) -> List[Dict]:
+    """
+    It creates every book with one executemany and returns the new ids
+    in the same order
+    """
+    data = [book_values(book) for book in books]
+
+    def insert(conn: Connection) -> List[int]:
+        return book_table.insert_many(conn, data)
+
+    ids = await engine.write_async(insert)
+    return [
+        {'index': i, 'id_book': id_book, 'status': 'created'}
+        for i, id_book in enumerate(ids)
+        ]
+
+
+# Update books
+@book_router.put(
+    path="/books/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_model=List[Dict],
+    summary="Update many books in one transaction"
+    )
+async def update_books(books: List[BookUpdate] = Body(...)) -> List[Dict]:
+    """
+    It updates every existing book with one executemany; unknown ids and
+    items without changes are reported per item
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    def update(conn: Connection) -> List[Dict]:
+        current = book_table.get_many(
+            conn, (book.id_book for book in books)
+            )
+        results = []
+        for i, book in enumerate(books):
+            result = {'index': i, 'id_book': book.id_book}
+            bookUpdate = book.dict(
+                exclude_unset=True, exclude_none=True,
+                exclude={'date_update'}
+                )
+            if len(bookUpdate) < 2:
+                result['error'] = "¡It is necessary a feature to change!"
+            elif book.id_book not in current:
+                result['error'] = "¡The book does not exists!"
+            else:
+                current[book.id_book].update(bookUpdate)
+                result['status'] = 'updated'
+            results.append(result)
+        changed = {r['id_book'] for r in results if 'status' in r}
+        for id_book in changed:
+            current[id_book]['date_update'] = today
+        book_table.update_many(
+            conn, (current[id_book] for id_book in changed)
+            )
+        return results
+
+    results = await engine.write_async(update)
+    book_cache.invalidate(
+        *(r['id_book'] for r in results if 'status' in r)
+        )
+    return results
+
+
+# Delete books
+@book_router.delete(
+    path="/books/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_model=List[Dict],
+    summary="Delete many books in one transaction"
+    )
+async def delete_books(ids: List[int] = Body(...)) -> List[Dict]:
+    """
+    It deletes every existing book with one DELETE ... RETURNING per
+    chunk of ids
+    """
+    def delete(conn: Connection) -> List[Dict]:
+        found = book_table.delete_many(conn, ids)
+        return [
+            {'index': i, 'id_book': id_book, 'status': 'deleted'}
+            if id_book in found else
+            {'index': i, 'id_book': id_book,
+             'error': "¡The book does not exists!"}
+            for i, id_book in enumerate(ids)
+            ]
+
+    results = await engine.write_async(delete)
+    book_cache.invalidate(
+        *(r['id_book'] for r in results if 'status' in r)
+        )
     return results
+
+
+# Export
+@book_router.get(
+    path="/books/export",
+    status_code=status.HTTP_200_OK,
+    tags=["Book"],
+    response_class=StreamingResponse,
+    summary="Export all books"
+    )
+async def export_books(
+    format: ExportFormat = Query(
+        default=ExportFormat.ndjson,
+        title="Output format"
+        )
+) -> StreamingResponse:
+    """
+    Streams every book as NDJSON or CSV
+    """
+    return StreamingResponse(
+        export_rows(
+            export_pool, book_table.table, book_table.public, book_table.key,
+            format
+            ),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            'Content-Disposition':
+            f'attachment; filename="books.{format.value}"'
+            }
+        )
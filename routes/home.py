@@ -3,9 +3,21 @@ from typing import Dict
 
 # FastAPI
 from fastapi import APIRouter
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi import status
 
+# Base data
+from database.funtionsDB import engine, export_pool
+from database.funtionsDB import book_cache, author_cache, user_cache
+
+# Metrics
+from middlewares.admission import admission
+from middlewares.metrics import registry
+
+# Security
+from security.passwords import password_hasher
+from security.tokens import token_signer
+
 home_router = APIRouter()
 
 
@@ -15,6 +27,43 @@ home_router = APIRouter()
     status_code=status.HTTP_200_OK,
     tags=["Home"]
     )
-def home() -> Dict:
+async def home() -> Dict:
     return HTMLResponse('<h1> Hello word FastAPI</h1>')
     # return {"Hello": "World"}
+
+
+# Runtime statistics
+@home_router.get(
+    path='/stats',
+    status_code=status.HTTP_200_OK,
+    tags=["Home"],
+    summary="Shows runtime statistics"
+    )
+async def stats() -> Dict:
+    return {
+        'storage': engine.stats(),
+        'exports': export_pool.stats(),
+        'cache': {
+            'book': book_cache.stats(),
+            'author': author_cache.stats(),
+            'user': user_cache.stats(),
+            },
+        'passwords': password_hasher.stats(),
+        'tokens': token_signer.stats(),
+        'admission': admission.stats()
+        }
+
+
+# Prometheus metrics
+@home_router.get(
+    path='/metrics',
+    status_code=status.HTTP_200_OK,
+    tags=["Home"],
+    response_class=PlainTextResponse,
+    summary="Request metrics in Prometheus text format"
+    )
+async def metrics() -> PlainTextResponse:
+    return PlainTextResponse(
+        registry.render(),
+        media_type="text/plain; version=0.0.4"
+        )
@@ -0,0 +1,66 @@
+# Python
+from sqlite3 import Connection
+
+# FastAPI
+from fastapi import APIRouter
+from fastapi import status
+from fastapi import Body
+from fastapi import HTTPException
+
+# Base data
+from database.funtionsDB import engine
+from database.funtionsDB import user_cache
+from repositories.user import get_by_email, replace_password
+from security.passwords import password_hasher, HasherBusy
+from security.tokens import token_signer
+
+# Model
+from schemas.login import Login, LoginOut
+
+login_router = APIRouter()
+
+
+# Login a user
+@login_router.post(
+    path="/login",
+    status_code=status.HTTP_200_OK,
+    tags=["Login"],
+    response_model=LoginOut,
+    summary="Login a user"
+    )
+async def login(login: Login = Body(...)) -> LoginOut:
+    """
+    It checks the password in the hashing workers and returns a bearer
+    token for the write routes. A password stored with older hashing
+    parameters, or in plaintext, is replaced by a new hash
+    """
+    user = await engine.read_async(get_by_email, login.email)
+    # An unknown email is checked against a dummy hash, so the response
+    # time does not tell which emails are registered
+    encoded = password_hasher.dummy if user is None else user['password']
+    try:
+        ok, new_hash = await password_hasher.verify(
+            login.password.get_secret_value(), encoded
+            )
+    except HasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="¡Too many password operations, try again later!",
+            headers={'Retry-After': '1'}
+            )
+    if user is None or not ok:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="¡Incorrect email or password!",
+            headers={'WWW-Authenticate': 'Bearer'}
+            )
+    if new_hash is not None:
+        def rehash(conn: Connection) -> bool:
+            return replace_password(
+                conn, user['id_user'], user['password'], new_hash
+                )
+
+        if await engine.write_async(rehash):
+            user_cache.invalidate(user['id_user'])
+    token, expires_in = token_signer.issue(user['id_user'], user['email'])
+    return {'access_token': token, 'expires_in': expires_in}
@@ -0,0 +1,96 @@
+# Python
+from typing import Dict, List, Optional
+
+# FastAPI
+from fastapi import status
+from fastapi import Query, Security
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+
+# Base data
+from database.pagination import INT64_MAX
+
+# Security
+from security.tokens import InvalidToken, token_signer
+
+# Most ids one batch read accepts, as many rows as the largest list page
+MAX_BATCH_IDS = 1000
+
+
+async def id_list(
+    ids: str = Query(
+        ...,
+        min_length=1,
+        max_length=16 * MAX_BATCH_IDS,
+        regex=r"^\s*\d+\s*(,\s*\d+\s*)*$",
+        title="Ids",
+        description=f"Comma separated ids, at most {MAX_BATCH_IDS}",
+        example="1,2,3"
+        )
+) -> List[int]:
+    """ FastAPI dependency parsing ?ids=1,2,3
+    - Returns:
+      The ids in request order, without repetitions
+    - Raises:
+      HTTPException 406 if there are too many ids or an id is 0 or does
+      not fit a SQLite INTEGER
+    """
+    values = list(dict.fromkeys(int(id) for id in ids.split(',')))
+    if len(values) > MAX_BATCH_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"¡At most {MAX_BATCH_IDS} ids per request!"
+            )
+    if min(values) < 1 or max(values) > INT64_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"¡The ids must be between 1 and {INT64_MAX}!"
+            )
+    return values
+
+
+# Error of a request changing another user
+NOT_OWNER = "¡You can only change your own user!"
+
+# Reads the Authorization header; a missing one is answered below with 401
+bearer = HTTPBearer(auto_error=False)
+
+
+async def current_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Security(bearer)
+) -> Dict:
+    """ FastAPI dependency of the write routes, checking the bearer token
+    issued by /login without a database query
+    - Returns:
+      The claims of the token, {'id_user', 'email', 'iat', 'exp'}
+    - Raises:
+      HTTPException 401 if the token is missing, invalid or expired
+    """
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="¡Not authenticated!",
+            headers={'WWW-Authenticate': 'Bearer'}
+            )
+    try:
+        return token_signer.verify(credentials.credentials)
+    except InvalidToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="¡The token is not valid or has expired!",
+            headers={'WWW-Authenticate': 'Bearer'}
+            )
+
+
+def owner_only(claims: Dict, id_user: int) -> None:
+    """ A user can only change, link books to or delete itself
+    - Args:
+      claims: returned by current_user
+    - Raises:
+      HTTPException 403 if the token belongs to another user
+    """
+    if claims['id_user'] != id_user:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=NOT_OWNER
+            )
@@ -1,21 +1,47 @@
 # Python
 import re
-from typing import List
+from functools import partial
+from typing import List, Dict, Optional, Tuple
+from sqlite3 import Connection, IntegrityError
 
 # FastAPI
 from fastapi import APIRouter
 from fastapi import status
-from fastapi import Body, Query, Path
+from fastapi import Body, Query, Depends, Path
 from fastapi import HTTPException
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+# Config
+import config
 
 # Base data
-from database.funtionsDB import connectionDB
+from database.funtionsDB import engine, export_pool, chunks, placeholders
+from database.funtionsDB import user_cache
+from database.export import ExportFormat, MEDIA_TYPES, export_rows
+from database.pagination import page_headers
+from repositories.user import user_table, user_values
+from repositories.book import book_table
+from repositories.links import user_books, with_authors
+from routes.params import NOT_OWNER, current_user, id_list, owner_only
+from security.passwords import password_hasher, HasherBusy
+from security.tokens import token_signer
 
 # Model
-from schemas.user import User, UserUpdate
+from schemas.user import User, UserUpdate, UserSort, UserBookLink
+from schemas.user import UserBatch, UserDetails
+from schemas.book import BookInclude, LinkedBook
+from schemas.serializers import ModelSerializer, RowSerializer
 
 user_router = APIRouter()
 
+# Encodes list pages when config.FAST_JSON is set
+user_list_serializer = RowSerializer(UserDetails, user_table.columns)
+# Validate and encode the large responses in the threadpool
+user_page_serializer = ModelSerializer(List[UserDetails])
+user_batch_serializer = ModelSerializer(UserBatch)
+user_books_serializer = ModelSerializer(List[LinkedBook], exclude_unset=True)
+
 
 # Funtions
 def it_is_email(email):
@@ -23,6 +49,36 @@ def it_is_email(email):
     return re.match(regex, email) is not None
 
 
+async def password_hashes(passwords: List[str]) -> List[str]:
+    """ Hashes of the passwords, made by the hashing worker processes
+    - Raises:
+      HTTPException 406 if there are more than config.PASSWORD_MAX_BULK
+      HTTPException 503 if too many passwords are already waiting
+    """
+    if len(passwords) > config.PASSWORD_MAX_BULK:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=f"¡At most {config.PASSWORD_MAX_BULK} passwords "
+            "per request!"
+            )
+    try:
+        return await password_hasher.hash_many(passwords)
+    except HasherBusy:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="¡Too many password operations, try again later!",
+            headers={'Retry-After': '1'}
+            )
+
+
+def email_exists() -> HTTPException:
+    """ Error of a write rejected by the unique index on User(email) """
+    return HTTPException(
+        status_code=status.HTTP_406_NOT_ACCEPTABLE,
+        detail="¡This email already exists!"
+        )
+
+
 # User
 # Create a User
 @user_router.post(
@@ -32,44 +88,26 @@ def it_is_email(email):
     response_model=User,
     summary="Create a new user"
     )
-def create_user(user: User = Body(...)) -> User:
+async def create_user(user: User = Body(...)) -> User:
     """
-    It creates a user
+    It creates a user; a taken email is detected by the INSERT itself
+    (ON CONFLICT on the unique email index). Only the password hash is
+    stored
     """
-    conn = connectionDB()
-    sql = ''' INSERT INTO User(firts_name, last_name, \
-    email, birth_date, password)
-              VALUES(?,?,?,?,?) '''
-    if user.birth_date is not None:
-        birth_date = user.birth_date.strftime("%Y-%m-%d")
-    else:
-        birth_date = None
-    data = (
-        user.firts_name,
-        user.last_name,
-        user.email,
-        birth_date,
-        user.password.get_secret_value()
-        )
     if not it_is_email(user.email):
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡It is not valid email!"
             )
-    cur = conn.cursor()
-    # detect if email exists in DB
-    cur.execute("SELECT * FROM User WHERE email=?", (user.email,))
-    rows = cur.fetchall()
-    if len(rows) > 0:
-        conn.close()
-        raise HTTPException(
-            status_code=status.HTTP_406_NOT_ACCEPTABLE,
-            detail="¡This email already exists!"
-            )
-    cur.execute(sql, data)
-    id_user = cur.lastrowid
-    conn.commit()
-    conn.close()
+    password, = await password_hashes([user.password.get_secret_value()])
+    data = user_values(user, password)
+
+    def insert(conn: Connection) -> Optional[int]:
+        return user_table.insert_unique(conn, data)
+
+    id_user = await engine.write_async(insert)
+    if id_user is None:
+        raise email_exists()
     results = user.dict()
     results.update({'id_user': id_user})
     return results
@@ -80,25 +118,51 @@ def create_user(user: User = Body(...)) -> User:
     path="/users",
     status_code=status.HTTP_200_OK,
     summary="Shows all users",
-    response_model=List[User],
+    response_model=List[UserDetails],
     tags=["User"]
 )
-def show_all_users() -> List[User]:
+async def show_all_users(
+    request: Request,
+    limit: int = Query(
+        default=100,
+        ge=1,
+        le=1000,
+        title="Page size"
+        ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Page cursor",
+        description="X-Next-Cursor header of the previous page"
+        ),
+    sort: UserSort = Query(
+        default=UserSort.id_user,
+        title="Sort key"
+        )
+) -> List[UserDetails]:
     """
-    Shows all users
+    Shows all users, one keyset page at a time; the cursor of the
+    next page is sent in the X-Next-Cursor and Link headers
     """
-    conn = connectionDB()
-    cur = conn.cursor()
-    colums = 'id_user,firts_name,last_name,email,birth_date,password'
-    cur.execute(f"SELECT {colums} FROM User")
-    rows = cur.fetchall()
-    conn.close()
-    list_keys = colums.split(',')
-    results = list(
-        map(
-            lambda x: {list_keys[i]: x[i] for i in range(len(x))}, rows)
+    try:
+        rows, next_cursor = await engine.read_shared(
+            ('users', sort.value, cursor, limit),
+            user_table.page, sort.value, cursor, limit
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    headers = page_headers(request.url, next_cursor)
+    if config.FAST_JSON:
+        return Response(
+            user_list_serializer.render(rows),
+            media_type="application/json",
+            headers=headers
+            )
+    return await user_page_serializer.response(
+        list(map(user_table.to_dict, rows)), headers
         )
-    return results
 
 
 # Read a user
@@ -106,35 +170,186 @@ def show_all_users() -> List[User]:
     path="/user/details",
     status_code=status.HTTP_200_OK,
     tags=["User"],
-    response_model=User,
+    response_model=UserDetails,
     summary="Show details about a user"
     )
-def show_user(
+async def show_user(
     id_user: int = Query(
         ...,
         gt=0,
         title="User id",
         description="User id unique"
         )
-) -> User:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = 'id_user,firts_name,last_name,email,birth_date,password'
-    cur.execute(f"SELECT {features} FROM User WHERE id_user=?", (id_user,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+) -> UserDetails:
+    results = await user_cache.get_or_load_async(
+        id_user, engine.shared_loader('user', user_table.get)
+        )
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The user does not exists!"
             )
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
     return results
 
 
+# Read many users
+@user_router.get(
+    path="/users/batch",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=UserBatch,
+    summary="Show many users by id"
+    )
+async def show_users_batch(ids: List[int] = Depends(id_list)) -> UserBatch:
+    """
+    Cached users come from user_cache and the rest from one IN (...)
+    query; items keep the order of ids, unknown ids are listed in missing
+    """
+    found = await user_cache.get_many_or_load_async(
+        ids, partial(engine.read_async, user_table.get_many)
+        )
+    return await user_batch_serializer.response({
+        'items': [found[id] for id in ids if id in found],
+        'missing': [id for id in ids if id not in found]
+        })
+
+
+# Books of a user
+# Read the books of a user
+@user_router.get(
+    path="/user/{id_user}/books",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=List[LinkedBook],
+    response_model_exclude_unset=True,
+    summary="Shows the books of a user"
+    )
+async def show_user_books(
+    request: Request,
+    id_user: int = Path(
+        ...,
+        gt=0,
+        title="User id",
+        description="User id unique"
+        ),
+    limit: int = Query(
+        default=100,
+        ge=1,
+        le=1000,
+        title="Page size"
+        ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Page cursor",
+        description="X-Next-Cursor header of the previous page"
+        ),
+    include: Optional[BookInclude] = Query(
+        default=None,
+        title="Related rows",
+        description="authors: the authors of each book, in one query "
+        "for the whole page"
+        )
+) -> List[LinkedBook]:
+    """
+    Books by id, one keyset page of a single JOIN at a time; the cursor
+    of the next page is sent in the X-Next-Cursor and Link headers
+    """
+    def read(conn: Connection) -> Tuple[Optional[List], Optional[str]]:
+        rows, next_cursor = user_books.page(conn, id_user, cursor, limit)
+        # Only an empty page needs to tell an unknown user apart
+        if not rows and user_table.get(conn, id_user) is None:
+            return None, None
+        books = list(map(book_table.to_dict, rows))
+        if include is BookInclude.authors:
+            with_authors(conn, books)
+        return books, next_cursor
+
+    try:
+        books, next_cursor = await engine.read_shared(
+            ('user books', id_user, cursor, limit, include), read
+            )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail=str(e)
+            )
+    if books is None:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The user does not exists!"
+            )
+    return await user_books_serializer.response(
+        books, page_headers(request.url, next_cursor)
+        )
+
+
+# Link a book
+@user_router.post(
+    path="/user/book/link",
+    status_code=status.HTTP_201_CREATED,
+    tags=["User"],
+    response_model=dict,
+    summary="Add a book to a user"
+    )
+async def link_user_book(
+    link: UserBookLink = Body(...),
+    claims: Dict = Depends(current_user)
+) -> dict:
+    owner_only(claims, link.id_user)
+
+    def insert(conn: Connection) -> bool:
+        return user_books.link(conn, link.id_user, link.id_book)
+
+    try:
+        linked = await engine.write_async(insert)
+    except IntegrityError:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The user or the book does not exists!"
+            )
+    if not linked:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The book is already linked to the user!"
+            )
+    return {'id_user': link.id_user, 'id_book': link.id_book,
+            'status': 'linked'}
+
+
+# Unlink a book
+@user_router.delete(
+    path="/user/book/unlink",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=dict,
+    summary="Remove a book from a user"
+    )
+async def unlink_user_book(
+    id_user: int = Query(
+        ...,
+        gt=0,
+        title="User id"
+        ),
+    id_book: int = Query(
+        ...,
+        gt=0,
+        title="Book id"
+        ),
+    claims: Dict = Depends(current_user)
+) -> dict:
+    owner_only(claims, id_user)
+
+    def delete(conn: Connection) -> bool:
+        return user_books.unlink(conn, id_user, id_book)
+
+    if not await engine.write_async(delete):
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡The book is not linked to the user!"
+            )
+    return {'id_user': id_user, 'id_book': id_book, 'status': 'unlinked'}
+
+
 # Update a user (Deprecated)
 @user_router.put(
     path="/user/update_user/{id_user}/{feature}/{data}",
@@ -143,7 +358,7 @@ def show_user(
     summary="Updates a user",
     deprecated=True
     )
-def update_user(
+async def update_user(
     id_user: int = Path(
         ...,
         title="user id",
@@ -158,27 +373,40 @@ def update_user(
         ...,
         title="data",
         description="data changing"
-    )
+    ),
+    claims: Dict = Depends(current_user)
 ):
+    owner_only(claims, id_user)
+    # SQLite column names are case-insensitive, PASSWORD is password
+    feature = feature.lower()
+    if feature not in user_table.fields:
+        raise HTTPException(
+            status_code=status.HTTP_406_NOT_ACCEPTABLE,
+            detail="¡It is not a feature of the user!"
+            )
     if feature == 'email' and not it_is_email(data):
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡It is not valid email!"
             )
-    conn = connectionDB()
-    cur = conn.cursor()
-    cur.execute(f"SELECT {feature} FROM User WHERE id_user=?", (id_user,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    value = data
+    if feature == 'password':
+        value, = await password_hashes([data])
+
+    def update(conn: Connection) -> Optional[dict]:
+        try:
+            return user_table.update(conn, id_user, {feature: value})
+        except IntegrityError:
+            raise email_exists()
+
+    if await engine.write_async(update) is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The user does not exists!"
             )
-    query = f"UPDATE user SET {feature} = '{data}' WHERE id_user = {id_user}"
-    cur.execute(query)
-    conn.commit()
-    conn.close()
+    user_cache.invalidate(id_user)
+    if feature == 'password':
+        token_signer.revoke(id_user)
     result = {
         'mesmessage': 'Update successful',
         'id_user': id_user,
@@ -192,51 +420,45 @@ def update_user(
     path="/user/update",
     status_code=status.HTTP_200_OK,
     tags=["User"],
-    response_model=User,
+    response_model=UserDetails,
     summary="Updates a user"
     )
-def update_user2(user: UserUpdate = Body(...)) -> User:
-    userUpdate = user.dict()
-    [userUpdate.pop(b) for b in userUpdate.copy() if userUpdate.get(b) is None]
+async def update_user2(
+    user: UserUpdate = Body(...),
+    claims: Dict = Depends(current_user)
+) -> UserDetails:
+    """
+    Only the features sent are written, in one UPDATE ... RETURNING
+    """
+    owner_only(claims, user.id_user)
+    userUpdate = user.dict(exclude_unset=True, exclude_none=True)
     if len(userUpdate) < 2:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡It is necessary a feature to change!"
             )
-    conn = connectionDB()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM User WHERE id_user=?", (user.id_user,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    userUpdate.pop('id_user')
+    if 'password' in userUpdate:
+        userUpdate['password'], = await password_hashes(
+            [user.password.get_secret_value()]
+            )
+
+    def update(conn: Connection) -> Optional[dict]:
+        try:
+            return user_table.update(conn, user.id_user, userUpdate)
+        except IntegrityError:
+            raise email_exists()
+
+    results = await engine.write_async(update)
+    if results is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The user does not exists!"
             )
-    features = 'id_user,firts_name,last_name,email,password,birth_date'
-    list_keys = features.split(',')
-    row = rows[0]
-    dataUpdate = {list_keys[i]: row[i] for i in range(len(row))}
-    dataUpdate.update(userUpdate)
-    sql = ''' UPDATE User
-              SET firts_name = ? ,
-                  last_name = ? ,
-                  email = ?,
-                  birth_date = ?,
-                  password = ?
-              WHERE id_user = ?'''
-    values = (
-        dataUpdate['firts_name'],
-        dataUpdate['last_name'],
-        dataUpdate['email'],
-        dataUpdate['birth_date'],
-        dataUpdate['password'],
-        dataUpdate['id_user']
-    )
-    cur.execute(sql, values)
-    conn.commit()
-    conn.close()
-    return dataUpdate
+    user_cache.invalidate(user.id_user)
+    if 'password' in userUpdate:
+        token_signer.revoke(user.id_user)
+    return results
 
 
 # Delete a user
@@ -247,29 +469,209 @@ def update_user2(user: UserUpdate = Body(...)) -> User:
     response_model=dict,
     tags=["User"]
 )
-def delete_a_user(id_user: int = Query(
+async def delete_a_user(id_user: int = Query(
         ...,
         gt=0,
         title="User id",
         description="User id unique"
-        )
+        ),
+    claims: Dict = Depends(current_user)
 ) -> dict:
-    conn = connectionDB()
-    cur = conn.cursor()
-    features = 'id_user,firts_name,last_name,email,birth_date'
-    cur.execute(f"SELECT {features} FROM User WHERE id_user=?", (id_user,))
-    rows = cur.fetchall()
-    if len(rows) == 0:
-        conn.close()
+    owner_only(claims, id_user)
+
+    def delete(conn: Connection) -> Optional[dict]:
+        return user_table.delete(conn, id_user)
+
+    row = await engine.write_async(delete)
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_406_NOT_ACCEPTABLE,
             detail="¡The user does not exists!"
             )
-    sql = 'DELETE FROM User WHERE id_user=?'
-    cur.execute(sql, (id_user,))
-    conn.commit()
-    conn.close()
-    list_keys = features.split(',')
-    row = rows[0]
-    results = {list_keys[i]: row[i] for i in range(len(row))}
+    user_cache.invalidate(id_user)
+    token_signer.revoke(id_user)
+    return {feature: row[feature] for feature in user_table.public}
+
+
+# Bulk
+# Create users
+@user_router.post(
+    path="/users/bulk",
+    dependencies=[Depends(current_user)],
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=List[Dict],
+    summary="Create many users in one transaction"
+    )
+async def create_users(users: List[User] = Body(...)) -> List[Dict]:
+    """
+    It creates every user with a valid and unused email with one
+    executemany; the other items are reported per item
+    """
+    valid = [i for i, user in enumerate(users) if it_is_email(user.email)]
+    hashes = dict(zip(valid, await password_hashes(
+        [users[i].password.get_secret_value() for i in valid]
+        )))
+
+    def insert(conn: Connection) -> List[Dict]:
+        emails = list({user.email for user in users})
+        taken = set()
+        for chunk in chunks(emails):
+            cur = conn.execute(
+                "SELECT email FROM User "
+                f"WHERE email IN ({placeholders(chunk)})", chunk)
+            taken.update(row[0] for row in cur)
+        results = []
+        data = []
+        for i, user in enumerate(users):
+            result = {'index': i, 'email': user.email}
+            if not it_is_email(user.email):
+                result['error'] = "¡It is not valid email!"
+            elif user.email in taken:
+                result['error'] = "¡This email already exists!"
+            else:
+                taken.add(user.email)
+                data.append(user_values(user, hashes[i]))
+                result['status'] = 'created'
+            results.append(result)
+        ids = iter(user_table.insert_many(conn, data))
+        for result in results:
+            if 'status' in result:
+                result['id_user'] = next(ids)
+        return results
+
+    return await engine.write_async(insert)
+
+
+# Update users
+@user_router.put(
+    path="/users/bulk",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=List[Dict],
+    summary="Update many users in one transaction"
+    )
+async def update_users(
+    users: List[UserUpdate] = Body(...),
+    claims: Dict = Depends(current_user)
+) -> List[Dict]:
+    """
+    It updates every existing user with one executemany; unknown ids,
+    users other than the caller and items without changes are reported
+    per item (an email already taken rejects the whole batch)
+    """
+    caller = claims['id_user']
+    changing = [
+        i for i, user in enumerate(users)
+        if user.password is not None and user.id_user == caller
+        ]
+    hashes = dict(zip(changing, await password_hashes(
+        [users[i].password.get_secret_value() for i in changing]
+        )))
+
+    def update(conn: Connection) -> List[Dict]:
+        current = user_table.get_many(conn, (user.id_user for user in users))
+        results = []
+        for i, user in enumerate(users):
+            result = {'index': i, 'id_user': user.id_user}
+            userUpdate = user.dict(exclude_unset=True, exclude_none=True)
+            if 'password' in userUpdate:
+                userUpdate['password'] = hashes.get(i)
+            if user.id_user != caller:
+                result['error'] = NOT_OWNER
+            elif len(userUpdate) < 2:
+                result['error'] = "¡It is necessary a feature to change!"
+            elif user.id_user not in current:
+                result['error'] = "¡The user does not exists!"
+            else:
+                current[user.id_user].update(userUpdate)
+                result['status'] = 'updated'
+            results.append(result)
+        changed = {r['id_user'] for r in results if 'status' in r}
+        try:
+            user_table.update_many(
+                conn, (current[id_user] for id_user in changed)
+                )
+        except IntegrityError:
+            # Rolled back as a whole by the engine
+            raise email_exists()
+        return results
+
+    results = await engine.write_async(update)
+    user_cache.invalidate(
+        *(r['id_user'] for r in results if 'status' in r)
+        )
+    token_signer.revoke(
+        *(r['id_user'] for r in results if 'status' in r
+          and r['index'] in hashes)
+        )
+    return results
+
+
+# Delete users
+@user_router.delete(
+    path="/users/bulk",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_model=List[Dict],
+    summary="Delete many users in one transaction"
+    )
+async def delete_users(
+    ids: List[int] = Body(...),
+    claims: Dict = Depends(current_user)
+) -> List[Dict]:
+    """
+    It deletes every existing user with one DELETE ... RETURNING per
+    chunk of ids; only the caller can be deleted, the other ids are
+    reported per item
+    """
+    caller = claims['id_user']
+
+    def delete(conn: Connection) -> List[Dict]:
+        found = user_table.delete_many(
+            conn, (id_user for id_user in ids if id_user == caller)
+            )
+        return [
+            {'index': i, 'id_user': id_user, 'status': 'deleted'}
+            if id_user in found else
+            {'index': i, 'id_user': id_user,
+             'error': NOT_OWNER if id_user != caller
+             else "¡The user does not exists!"}
+            for i, id_user in enumerate(ids)
+            ]
+
+    results = await engine.write_async(delete)
+    deleted = [r['id_user'] for r in results if 'status' in r]
+    user_cache.invalidate(*deleted)
+    token_signer.revoke(*deleted)
     return results
+
+
+# Export
+@user_router.get(
+    path="/users/export",
+    status_code=status.HTTP_200_OK,
+    tags=["User"],
+    response_class=StreamingResponse,
+    summary="Export all users"
+    )
+async def export_users(
+    format: ExportFormat = Query(
+        default=ExportFormat.ndjson,
+        title="Output format"
+        )
+) -> StreamingResponse:
+    """
+    Streams every user as NDJSON or CSV without passwords
+    """
+    return StreamingResponse(
+        export_rows(
+            export_pool, user_table.table, user_table.public, user_table.key,
+            format
+            ),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            'Content-Disposition':
+            f'attachment; filename="users.{format.value}"'
+            }
+        )
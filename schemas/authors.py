@@ -1,12 +1,19 @@
 # Python
-from typing import Optional
+from typing import List, Optional
 from datetime import date
+from enum import Enum
 
 # Pydantic
 from pydantic import BaseModel
 from pydantic import Field
 
 
+# Models
+class AuthorSort(Enum):
+    id_author = "id_author"
+    name = "name"
+
+
 # Models Author
 class AuthorBase(BaseModel):
     name: str = Field(
@@ -29,7 +36,23 @@ class AuthorBase(BaseModel):
 
 
 class AuthorUpdate(AuthorBase):
+    name: Optional[str] = Field(
+        min_length=1,
+        max_length=124
+    )
+    id_author: int = Field(
+        ...,
+        gt=0
+    )
+
+
+class AuthorResult(AuthorBase):
     id_author: int = Field(
         ...,
         gt=0
     )
+
+
+class AuthorBatch(BaseModel):
+    items: List[AuthorResult]
+    missing: List[int]
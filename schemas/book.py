@@ -1,5 +1,5 @@
 # Python
-from typing import Optional
+from typing import List, Optional
 from enum import Enum
 from datetime import date
 
@@ -7,6 +7,9 @@ from datetime import date
 from pydantic import BaseModel
 from pydantic import Field
 
+# Model
+from schemas.authors import AuthorResult
+
 
 # Models
 class ReadingAge(Enum):
@@ -33,6 +36,15 @@ class Language(Enum):
         return str(self.value)
 
 
+class BookSort(Enum):
+    id_book = "id_book"
+    title = "title"
+
+
+class BookInclude(Enum):
+    authors = "authors"
+
+
 # Models Book
 class BookBase(BaseModel):
     title: str = Field(
@@ -85,3 +97,34 @@ class BookUpdate(BookBase):
         ...,
         gt=0
     )
+
+
+class BookResult(BookBase):
+    id_book: int = Field(
+        ...,
+        gt=0
+    )
+
+
+class BookDetails(BookBase):
+    authors: Optional[List[AuthorResult]] = None
+
+
+class LinkedBook(BookResult):
+    authors: Optional[List[AuthorResult]] = None
+
+
+class BookBatch(BaseModel):
+    items: List[BookResult]
+    missing: List[int]
+
+
+class BookAuthorLink(BaseModel):
+    id_book: int = Field(
+        ...,
+        gt=0
+    )
+    id_author: int = Field(
+        ...,
+        gt=0
+    )
@@ -0,0 +1,32 @@
+# Pydantic
+from pydantic import BaseModel
+from pydantic import SecretStr
+from pydantic import EmailStr
+from pydantic import Field
+
+
+class Login(BaseModel):
+    email: EmailStr = Field(
+        ...
+    )
+    password: SecretStr = Field(
+        ...,
+        min_length=8,
+        max_length=64
+    )
+
+
+class LoginOut(BaseModel):
+    access_token: str = Field(
+        ...
+    )
+    token_type: str = Field(
+        default="bearer"
+    )
+    expires_in: int = Field(
+        ...,
+        description="Seconds the token is valid"
+    )
+    message: str = Field(
+        default="Login Succesfully!"
+    )
@@ -0,0 +1,126 @@
+# Python
+import json
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Sequence, Type
+
+# Pydantic
+from pydantic import BaseModel, SecretStr, ValidationError
+
+# FastAPI
+from fastapi import Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.utils import create_response_field
+
+try:
+    import orjson
+except ImportError:
+    # Optional: the stdlib encoder gives the same bytes, only slower
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """ Compact UTF-8 JSON, byte for byte what JSONResponse renders """
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(
+        content,
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+        ).encode("utf-8")
+
+
+def mask(value: Any) -> Any:
+    """ A secret as jsonable_encoder renders it """
+    return None if value is None else str(SecretStr(value))
+
+
+class RowSerializer:
+    """ Database rows to the JSON body FastAPI sends for `model`, without
+    building and validating one model instance per row
+
+    Only for rows read from our own tables, which were validated on the
+    way in; the route keeps its response_model, so the OpenAPI schema
+    does not change.
+    - Args:
+      model: response model of the route
+      columns: selected columns, in row order
+    """
+
+    def __init__(
+        self,
+        model: Type[BaseModel],
+        columns: Sequence[str]
+    ) -> None:
+        position = {name: i for i, name in enumerate(columns)}
+        missing = [name for name in model.__fields__ if name not in position]
+        if missing:
+            raise ValueError(
+                f"{model.__name__} fields not selected: {', '.join(missing)}"
+                )
+        # Same keys, same order as model.dict()
+        self.keys = tuple(model.__fields__)
+        indexes = [position[name] for name in self.keys]
+        self.pick: Callable[[Sequence], tuple] = (
+            itemgetter(*indexes) if len(indexes) > 1
+            else lambda row: (row[indexes[0]],)
+            )
+        self.secrets = [
+            i for i, field in enumerate(model.__fields__.values())
+            if isinstance(field.type_, type)
+            and issubclass(field.type_, SecretStr)
+            ]
+
+    def values(self, row: Sequence) -> tuple:
+        values = self.pick(row)
+        if self.secrets:
+            values = list(values)
+            for i in self.secrets:
+                values[i] = mask(values[i])
+        return values
+
+    def render(self, rows: List[Sequence]) -> bytes:
+        keys = self.keys
+        if self.secrets:
+            items = map(self.values, rows)
+        else:
+            items = map(self.pick, rows)
+        return dumps([dict(zip(keys, values)) for values in items])
+
+
+class ModelSerializer:
+    """ The JSON body FastAPI sends for `model`, validated and encoded in
+    the threadpool instead of on the event loop
+
+    FastAPI validates the response_model of an async route on the event
+    loop, and a page of a few hundred rows takes tens of milliseconds,
+    during which no other connection is served. The route keeps its
+    response_model, so the OpenAPI schema does not change.
+    - Args:
+      model: response model of the route, List[...] included
+      exclude_unset: as response_model_exclude_unset of the route
+    """
+
+    def __init__(self, model: Any, exclude_unset: bool = False) -> None:
+        self.field = create_response_field(name='response', type_=model)
+        self.exclude_unset = exclude_unset
+
+    def encode(self, content: Any) -> bytes:
+        """ Same steps as fastapi.routing.serialize_response
+        - Raises:
+          ValidationError if content does not fit the model
+        """
+        value, errors = self.field.validate(content, {}, loc=('response',))
+        if errors:
+            raise ValidationError([errors], self.field.type_)
+        return dumps(jsonable_encoder(value, exclude_unset=self.exclude_unset))
+
+    async def response(
+        self,
+        content: Any,
+        headers: Optional[Dict[str, str]] = None
+    ) -> Response:
+        body = await run_in_threadpool(self.encode, content)
+        return Response(body, media_type="application/json", headers=headers)
@@ -1,6 +1,7 @@
 # Python
-from typing import Optional
+from typing import List, Optional
 from datetime import date
+from enum import Enum
 
 # Pydantic
 from pydantic import BaseModel
@@ -9,6 +10,12 @@ from pydantic import EmailStr
 from pydantic import Field
 
 
+# Models
+class UserSort(Enum):
+    id_user = "id_user"
+    email = "email"
+
+
 # Modes User
 class UserBase(BaseModel):
     firts_name: Optional[str] = Field(
@@ -49,3 +56,33 @@ class UserUpdate(User):
         ...,
         gt=0
     )
+
+
+class UserDetails(UserBase):
+    # Stored hash, longer than a password and always shown masked
+    password: SecretStr = Field(
+        ...
+    )
+
+
+class UserResult(UserDetails):
+    id_user: int = Field(
+        ...,
+        gt=0
+    )
+
+
+class UserBatch(BaseModel):
+    items: List[UserResult]
+    missing: List[int]
+
+
+class UserBookLink(BaseModel):
+    id_user: int = Field(
+        ...,
+        gt=0
+    )
+    id_book: int = Field(
+        ...,
+        gt=0
+    )
@@ -0,0 +1,342 @@
+# Python
+import asyncio
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Config
+import config
+
+# Metrics
+from middlewares.metrics import Histogram, labels, registry
+
+# Stored passwords look like
+#   scrypt$<n>$<r>$<p>$<salt>$<hash>
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# with base64 salt and hash. Rows written before hashing existed hold the
+# plaintext; they still verify and are rehashed on the next login.
+SCHEMES = {'scrypt': 3, 'pbkdf2_sha256': 1}
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """ Raised when max_pending hashing jobs are already waiting """
+
+
+def b64encode(raw: bytes) -> str:
+    return base64.b64encode(raw).decode().rstrip('=')
+
+
+def b64decode(text: str) -> bytes:
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def derive(
+    password: str,
+    salt: bytes,
+    scheme: str,
+    cost: Sequence[int]
+) -> bytes:
+    secret = password.encode()
+    if scheme == 'scrypt':
+        n, r, p = cost
+        return hashlib.scrypt(
+            secret, salt=salt, n=n, r=r, p=p, dklen=HASH_BYTES,
+            # scrypt needs about 128 * n * r bytes
+            maxmem=256 * n * r * p + 2 ** 20
+            )
+    if scheme == 'pbkdf2_sha256':
+        iterations, = cost
+        return hashlib.pbkdf2_hmac(
+            'sha256', secret, salt, iterations, dklen=HASH_BYTES
+            )
+    raise ValueError(f"¡Unknown password scheme {scheme}!")
+
+
+def hash_password(password: str, scheme: str, cost: Sequence[int]) -> str:
+    """ Encoded hash of password with a new random salt """
+    salt = os.urandom(SALT_BYTES)
+    digest = derive(password, salt, scheme, cost)
+    return '$'.join(
+        (scheme, *map(str, cost), b64encode(salt), b64encode(digest))
+        )
+
+
+def hash_passwords(
+    passwords: Sequence[str],
+    scheme: str,
+    cost: Sequence[int]
+) -> List[str]:
+    return [hash_password(password, scheme, cost) for password in passwords]
+
+
+def parse(
+    encoded: str
+) -> Optional[Tuple[str, Tuple[int, ...], bytes, bytes]]:
+    """ (scheme, cost, salt, hash) of an encoded hash, None for anything
+    else (a legacy plaintext password)
+    """
+    parts = encoded.split('$')
+    if parts[0] not in SCHEMES or len(parts) != SCHEMES[parts[0]] + 3:
+        return None
+    try:
+        cost = tuple(int(value) for value in parts[1:-2])
+        return parts[0], cost, b64decode(parts[-2]), b64decode(parts[-1])
+    except ValueError:
+        return None
+
+
+def verify_password(
+    password: str,
+    encoded: str,
+    dummy: Optional[str] = None
+) -> bool:
+    """ Constant time check of password against a stored value
+    - Args:
+      dummy: hash checked as well when encoded is a legacy plaintext, so
+      it takes as long as a hashed one
+    """
+    parsed = parse(encoded)
+    if parsed is None:
+        if dummy is not None:
+            verify_password(password, dummy)
+        return hmac.compare_digest(password.encode(), encoded.encode())
+    scheme, cost, salt, expected = parsed
+    return hmac.compare_digest(derive(password, salt, scheme, cost), expected)
+
+
+def lower_priority() -> None:
+    """ Hashing workers yield the CPU to the server process """
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+class PasswordHasher:
+    """ Hashes and verifies passwords in a pool of worker processes
+
+    A memory-hard hash takes tens of milliseconds of CPU; in a process
+    it neither holds the GIL nor blocks the event loop, so signups do not
+    slow down the other requests. At most max_pending passwords wait for
+    a worker, a call that would pass it raises HasherBusy. Bulk hashing
+    goes in jobs of `chunk` passwords, one per worker at a time, so the
+    logins queued meanwhile run between its jobs. Only used from the
+    event loop, so the counters need no locking.
+    - Args:
+      scheme: 'scrypt' or 'pbkdf2_sha256'
+      cost: (n, r, p) for scrypt, (iterations,) for pbkdf2_sha256
+      workers: worker processes
+      max_pending: passwords allowed to wait or be hashed at once
+      chunk: passwords per job of hash_many
+    """
+
+    def __init__(
+        self,
+        scheme: str = 'scrypt',
+        cost: Sequence[int] = (2 ** 14, 8, 1),
+        workers: int = 2,
+        max_pending: int = 256,
+        chunk: int = 8
+    ) -> None:
+        if SCHEMES.get(scheme) != len(cost):
+            raise ValueError(f"¡Bad cost {tuple(cost)} for {scheme}!")
+        self.scheme = scheme
+        self.cost = tuple(cost)
+        self.prefix = '$'.join((scheme, *map(str, self.cost))) + '$'
+        # Matches no password but costs as much to check as a stored hash
+        self.dummy = self.prefix + '$'.join((
+            b64encode(os.urandom(SALT_BYTES)),
+            b64encode(os.urandom(HASH_BYTES))
+            ))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.chunk = chunk
+        # Passwords reserved by the calls in progress
+        self.pending = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._stats = {'hashed': 0, 'verified': 0, 'rehashed': 0,
+                       'rejected': 0, 'restarts': 0}
+        self.latency = {'hash': Histogram(), 'verify': Histogram()}
+
+    def needs_rehash(self, encoded: str) -> bool:
+        """ True when encoded was not made with the current parameters """
+        return not encoded.startswith(self.prefix)
+
+    def _reserve(self, count: int) -> None:
+        """ Count passwords as pending
+        - Raises:
+          HasherBusy if they do not fit in max_pending
+        """
+        if self.pending + count > self.max_pending:
+            self._stats['rejected'] += 1
+            raise HasherBusy(
+                f"{self.pending} passwords are already waiting"
+                )
+        self.pending += count
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: the workers must not inherit the server's threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=lower_priority
+                )
+        return self._executor
+
+    async def _run(self, kind: str, fn, *args):
+        """ fn(*args) in a worker. A pool broken by a dead worker is
+        replaced and the job tried once more on the new one
+        - Raises:
+          HasherBusy if the new pool breaks too
+        """
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            for _ in range(2):
+                executor = self._pool()
+                try:
+                    return await loop.run_in_executor(executor, fn, *args)
+                except BrokenProcessPool:
+                    # The concurrent jobs of the same pool fail together,
+                    # only the first one replaces it
+                    if self._executor is executor:
+                        self._executor = None
+                        self._stats['restarts'] += 1
+                        executor.shutdown(wait=False)
+            raise HasherBusy("The password workers keep failing")
+        finally:
+            self.latency[kind].observe(time.perf_counter() - start)
+
+    async def hash(self, password: str) -> str:
+        self._reserve(1)
+        try:
+            encoded = await self._run(
+                'hash', hash_password, password, self.scheme, self.cost
+                )
+        finally:
+            self.pending -= 1
+        self._stats['hashed'] += 1
+        return encoded
+
+    async def hash_many(self, passwords: Sequence[str]) -> List[str]:
+        """ Hash in jobs of `chunk` passwords with at most one job per
+        worker queued, rather than the whole list at once
+        - Raises:
+          HasherBusy if the passwords do not fit in max_pending
+        """
+        if not passwords:
+            return []
+        self._reserve(len(passwords))
+        jobs = [
+            passwords[i:i + self.chunk]
+            for i in range(0, len(passwords), self.chunk)
+            ]
+        parts: List[List[str]] = [[] for _ in jobs]
+        todo = iter(enumerate(jobs))
+        left = len(passwords)
+
+        async def feed() -> None:
+            # Takes the next job once its previous one is done
+            nonlocal left
+            for i, job in todo:
+                parts[i] = await self._run(
+                    'hash', hash_passwords, job, self.scheme, self.cost
+                    )
+                self.pending -= len(job)
+                left -= len(job)
+
+        feeders = [
+            asyncio.ensure_future(feed())
+            for _ in range(min(self.workers, len(jobs)))
+            ]
+        try:
+            await asyncio.gather(*feeders)
+        finally:
+            for feeder in feeders:
+                feeder.cancel()
+            self.pending -= left
+        self._stats['hashed'] += len(passwords)
+        return [encoded for part in parts for encoded in part]
+
+    async def verify(
+        self,
+        password: str,
+        encoded: str
+    ) -> Tuple[bool, Optional[str]]:
+        """ Check password against its stored value
+        - Returns:
+          Whether it matches and, when it does but encoded uses other
+          parameters (or is a legacy plaintext), the new hash to store
+        """
+        self._reserve(1)
+        try:
+            ok = await self._run(
+                'verify', verify_password, password, encoded, self.dummy
+                )
+        finally:
+            self.pending -= 1
+        self._stats['verified'] += 1
+        if ok and self.needs_rehash(encoded):
+            self._stats['rehashed'] += 1
+            return True, await self.hash(password)
+        return ok, None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'scheme': self.scheme,
+            'cost': list(self.cost),
+            'workers': self.workers,
+            'pending': self.pending,
+            'max_pending': self.max_pending,
+            'chunk': self.chunk,
+            **self._stats,
+            }
+
+    def metrics(self) -> List[str]:
+        """ Prometheus lines for middlewares.metrics.registry """
+        lines = [
+            "# HELP password_pending Passwords queued or being hashed.",
+            "# TYPE password_pending gauge",
+            f"password_pending {self.pending}",
+            "# HELP password_operations_total Password operations.",
+            "# TYPE password_operations_total counter",
+            ]
+        for name, n in self._stats.items():
+            lines.append(
+                f"password_operations_total{labels(operation=name)} {n}"
+                )
+        lines.append(
+            "# HELP password_job_duration_seconds Time in the worker pool."
+            )
+        lines.append("# TYPE password_job_duration_seconds histogram")
+        for kind, h in self.latency.items():
+            lines.extend(h.lines("password_job_duration_seconds", kind=kind))
+        return lines
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    scheme=config.PASSWORD_SCHEME,
+    cost=(
+        (config.PASSWORD_SCRYPT_N, config.PASSWORD_SCRYPT_R, 1)
+        if config.PASSWORD_SCHEME == 'scrypt'
+        else (config.PASSWORD_PBKDF2_ITERATIONS,)
+        ),
+    workers=config.PASSWORD_WORKERS,
+    max_pending=config.PASSWORD_MAX_PENDING,
+    chunk=config.PASSWORD_CHUNK
+    )
+registry.collect(password_hasher.metrics)
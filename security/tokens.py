@@ -0,0 +1,129 @@
+# Python
+import hashlib
+import secrets
+import time
+from typing import Dict, Tuple
+
+# JWT
+import jwt
+
+# Config
+import config
+
+# Base data
+from database.cache import LRUCache
+
+
+class InvalidToken(Exception):
+    """ Raised for a token that is malformed, forged, expired or revoked """
+
+
+class TokenSigner:
+    """ Issues and verifies the signed JWTs returned by /login
+
+    Verified tokens are cached by their SHA-256, until they expire, so a
+    protected request costs a hash and a dict lookup instead of a
+    signature check, and the claims carry the user so no query is made.
+    Tokens of a user issued before revoke() (password change, deletion)
+    are rejected. Only used from the event loop.
+    - Args:
+      secret: HMAC key
+      algorithm: JWT algorithm, HS256 by default
+      ttl: seconds a token is valid
+      cache_size: verified tokens kept in memory
+    """
+
+    def __init__(
+        self,
+        secret: str,
+        algorithm: str = 'HS256',
+        ttl: int = 3600,
+        cache_size: int = 4096
+    ) -> None:
+        self.secret = secret
+        self.algorithm = algorithm
+        self.ttl = ttl
+        self.cache = LRUCache(maxsize=cache_size, ttl=0)
+        # id_user -> time of the last revocation, kept for one ttl
+        self._revoked: Dict[int, float] = {}
+        self._stats = {'issued': 0, 'verified': 0, 'rejected': 0}
+
+    def issue(self, id_user: int, email: str) -> Tuple[str, int]:
+        """ New token for a user
+        - Returns:
+          The token and the seconds it is valid
+        """
+        now = time.time()
+        claims = {
+            'sub': str(id_user),
+            'email': email,
+            # Sub-second, so a login right after a revocation is valid
+            'iat': now,
+            'exp': int(now) + self.ttl,
+            }
+        self._stats['issued'] += 1
+        return jwt.encode(claims, self.secret, self.algorithm), self.ttl
+
+    def verify(self, token: str) -> Dict:
+        """ Claims of a valid token
+        - Returns:
+          {'id_user', 'email', 'iat', 'exp'}
+        - Raises:
+          InvalidToken
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        user = self.cache.get(key)
+        if user is None:
+            user = self._decode(token)
+            remaining = user['exp'] - time.time()
+            if remaining > 0:
+                self.cache.set(key, user, ttl=remaining)
+        if user['iat'] <= self._revoked.get(user['id_user'], 0):
+            self._stats['rejected'] += 1
+            raise InvalidToken("Token revoked")
+        self._stats['verified'] += 1
+        return user
+
+    def _decode(self, token: str) -> Dict:
+        try:
+            claims = jwt.decode(
+                token, self.secret, algorithms=[self.algorithm],
+                options={'require': ['sub', 'iat', 'exp']}
+                )
+            return {
+                'id_user': int(claims['sub']),
+                'email': claims.get('email'),
+                'iat': float(claims['iat']),
+                'exp': int(claims['exp']),
+                }
+        except (jwt.PyJWTError, TypeError, ValueError) as e:
+            self._stats['rejected'] += 1
+            raise InvalidToken(str(e))
+
+    def revoke(self, *ids: int) -> None:
+        """ Reject the tokens issued so far to these users """
+        now = time.time()
+        # Tokens older than one ttl are expired anyway
+        self._revoked = {
+            id: at for id, at in self._revoked.items()
+            if at > now - self.ttl
+            }
+        self._revoked.update(dict.fromkeys(ids, now))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'algorithm': self.algorithm,
+            'ttl': self.ttl,
+            'revoked_users': len(self._revoked),
+            **self._stats,
+            'cache': self.cache.stats(),
+            }
+
+
+token_signer = TokenSigner(
+    # A per-process secret when none is configured
+    secret=config.JWT_SECRET or secrets.token_urlsafe(32),
+    algorithm=config.JWT_ALGORITHM,
+    ttl=config.JWT_TTL,
+    cache_size=config.TOKEN_CACHE_SIZE
+    )